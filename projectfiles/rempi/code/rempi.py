@@ -66,6 +66,8 @@ redis = StrictRedis(host='localhost', port=6379)
 proj_data = {'redis':redis}
 
 redis.set('rempi01_web_control', 'ENABLED')
+# and notify the pimqtt service, which holds the flag, that it has been set
+redis.publish('flags', 'rempi01_web_control')
 
 
 def start_call(called_ident, skicall):
@@ -38,10 +38,15 @@ def toggle_web_control(skicall):
     "Enable / disable the enable_web_control flag in proj_data"
     redis = skicall.proj_data['redis']
     web_control = redis.get('rempi01_web_control')
+    # set the flag, and publish its key on the 'flags' channel, so the pimqtt
+    # service drops the value it holds and reads the new one
+    pipe = redis.pipeline(transaction=True)
     if web_control == b'ENABLED':
-        redis.set('rempi01_web_control', 'DISABLED')
+        pipe.set('rempi01_web_control', 'DISABLED')
     else:
-        redis.set('rempi01_web_control', 'ENABLED')
+        pipe.set('rempi01_web_control', 'ENABLED')
+    pipe.publish('flags', 'rempi01_web_control')
+    pipe.execute()
 
 
 def refresh_results(skicall):
@@ -7,54 +7,42 @@
 from skipole import FailPage, GoTo, ValidateError, ServerError
 
 
+# A command sent while a motor is running replaces its current run, blending into the
+# new speed, or ramping down and reversing, so commands are always sent
+
+
 def m1clockwise(skicall):
     "set m1 clockwise"
     redis = skicall.proj_data['redis']
-    motor1status = redis.get('motor1status')
-    if motor1status == b"STOPPED":
-        _speed_duration('motor1', skicall)
-        skicall.page_data['motor1status','para_text'] = "Requesting Motor 1 clockwise start"
-        skicall.call_data['status'] = "Requesting Motor 1 clockwise start"
-        redis.publish("motor1control", "CLOCKWISE")
-    else:
-        skicall.page_data['motor1status','para_text'] = "Action unavailable"
+    _speed_duration('motor1', skicall)
+    skicall.page_data['motor1status','para_text'] = "Requesting Motor 1 clockwise start"
+    skicall.call_data['status'] = "Requesting Motor 1 clockwise start"
+    redis.publish("motor1control", "CLOCKWISE")
 
 
 def m1anticlockwise(skicall):
     "set m1 anti clockwise"
     redis = skicall.proj_data['redis']
-    motor1status = redis.get('motor1status')
-    if motor1status == b"STOPPED":
-        _speed_duration('motor1', skicall)
-        skicall.page_data['motor1status','para_text'] = "Requesting Motor 1 anti clockwise start"
-        skicall.call_data['status'] = "Requesting Motor 1 anti clockwise start"
-        redis.publish("motor1control", "ANTICLOCKWISE")
-    else:
-        skicall.page_data['motor1status','para_text'] = "Action unavailable"
+    _speed_duration('motor1', skicall)
+    skicall.page_data['motor1status','para_text'] = "Requesting Motor 1 anti clockwise start"
+    skicall.call_data['status'] = "Requesting Motor 1 anti clockwise start"
+    redis.publish("motor1control", "ANTICLOCKWISE")
 
 
 def m2clockwise(skicall):
     "set m2 clockwise"
     redis = skicall.proj_data['redis']
-    motor2status = redis.get('motor2status')
-    if motor2status == b"STOPPED":
-        _speed_duration('motor2', skicall)
-        skicall.page_data['motor2status','para_text'] = "Requesting Motor 2 clockwise start"
-        redis.publish("motor2control", "CLOCKWISE")
-    else:
-        skicall.page_data['motor2status','para_text'] = "Action unavailable"
+    _speed_duration('motor2', skicall)
+    skicall.page_data['motor2status','para_text'] = "Requesting Motor 2 clockwise start"
+    redis.publish("motor2control", "CLOCKWISE")
 
 
 def m2anticlockwise(skicall):
     "set m2 anticlockwise"
     redis = skicall.proj_data['redis']
-    motor2status = redis.get('motor2status')
-    if motor2status == b"STOPPED":
-        _speed_duration('motor2', skicall)
-        skicall.page_data['motor2status','para_text'] = "Requesting Motor 2 anti clockwise start"
-        redis.publish("motor2control", "ANTICLOCKWISE")
-    else:
-        skicall.page_data['motor2status','para_text'] = "Action unavailable"
+    _speed_duration('motor2', skicall)
+    skicall.page_data['motor2status','para_text'] = "Requesting Motor 2 anti clockwise start"
+    redis.publish("motor2control", "ANTICLOCKWISE")
 
 
 def _speed_duration(motor, skicall):
@@ -0,0 +1,354 @@
+#!/home/rempi/rempivenv/bin/python3
+
+
+#################################################################
+#
+# benchmark.py
+#
+# Development script, not used by the rempicontrol service
+#
+# Times parts of the telescope control code and checks their
+# results, run from the rempicontrol directory with
+#
+# python3 benchmark.py fit
+#
+#################################################################
+
+
+import sys, time
+
+import numpy as np
+
+from control import telescope, payload, simulate
+
+from control.simulate import star_altaz, MemoryRedis
+
+
+# realistic targets, (description, declination, hour angle at the track start)
+TRACKS = [ ("south, low",            -10.0,  -20.0),
+           ("east, mid altitude",     20.0,  -60.0),
+           ("near zenith",            53.0,   -1.0),
+           ("north, az wrap",         80.0,  178.0) ]
+
+
+def legacy_payload(name, dec, ha0, t0):
+    "Returns the 10s + 62d payload sent by the server for the given target, from timestamp t0"
+    return simulate.star_payload(name, dec, ha0, t0, t0)
+
+
+def legacy_curve_maker(timeseries, time_altaz):
+    "The scipy curve_fit implementation formerly used by Telescope.curve_maker, for comparison"
+    from scipy.optimize import curve_fit
+    altseries = [ time_altaz[tm][0] for tm in timeseries ]
+    popt_alt, pcov_alt = curve_fit(telescope._qcurve, timeseries, altseries)
+    azseries = [ time_altaz[tm][1] for tm in timeseries ]
+    if any(az > 270.0 for az in azseries):
+        azseries = [ az if az > 90 else az+360 for az in azseries ]
+    popt_az, pcov_az = curve_fit(telescope._qcurve, timeseries, azseries)
+    return popt_alt, popt_az
+
+
+def legacy_createcurves(time_altaz):
+    "The former Telescope.createcurves, coefficients are for unix timestamps"
+    timelist = sorted(time_altaz)
+    curves = {}
+    curves[timelist[0]] = legacy_curve_maker(timelist[:6], time_altaz)
+    curves[timelist[4]] = legacy_curve_maker(timelist[4:10], time_altaz)
+    curves[timelist[8]] = legacy_curve_maker(timelist[8:15], time_altaz)
+    curves[timelist[13]] = legacy_curve_maker(timelist[13:], time_altaz)
+    return curves
+
+
+def legacy_get_speed(scope, current_pos, speed, old_target_pos, target_pos):
+    "The former iterative Telescope.get_speed, for comparison"
+    target_distance = target_pos - old_target_pos
+    if target_distance > 180:
+        target_distance -= 360
+    elif target_distance < -180:
+        target_distance += 360
+    distance = old_target_pos - current_pos
+    if distance > 180:
+        distance -= 360
+    elif distance < -180:
+        distance += 360
+    if distance > scope.DECELERATION_DISTANCE:
+        delta_distance = scope.max_delta_distance
+    elif distance < -1*scope.DECELERATION_DISTANCE:
+        delta_distance =  -1 * scope.max_delta_distance
+    else:
+        delta_distance = scope.max_delta_distance * distance / scope.DECELERATION_DISTANCE
+        delta_distance +=  target_distance
+        if abs(delta_distance) > scope.max_delta_distance:
+            if delta_distance > 0:
+                delta_distance = scope.max_delta_distance
+            else:
+                delta_distance = -1 * scope.max_delta_distance
+    previous_distance = speed * scope.interval
+    while True:
+        newspeed = delta_distance/scope.interval
+        acceleration = (newspeed - speed)/scope.interval
+        if abs(acceleration) < scope.MAX_ACCELERATION:
+            break
+        delta_distance = (5*delta_distance + previous_distance)/6.0
+    return newspeed
+
+
+def _angle_error(a, b):
+    "Returns the absolute difference between angles a and b in degrees, allowing for the 360->0 wrap"
+    return np.abs((np.asarray(a) - np.asarray(b) + 180.0) % 360.0 - 180.0)
+
+
+def _timeit(function, repeat):
+    "Returns the mean time in seconds for a call of function"
+    start = time.perf_counter()
+    for n in range(repeat):
+        function()
+    return (time.perf_counter() - start)/repeat
+
+
+def bench_fit(repeat=50):
+    """Compares the closed form curve fit with the former scipy curve_fit, reporting the
+       goto to tracking latency, and the position differences between the two fits"""
+    t0 = time.time()
+    rconn = MemoryRedis()
+    scope = simulate.SimTelescope(rconn, {})
+    print("%-20s %14s %14s %14s %14s %14s" % ("track", "scipy goto ms", "numpy goto ms", "max diff fits",
+                                             "scipy max err", "numpy max err"))
+    for name, dec, ha0 in TRACKS:
+        msg = {'data': legacy_payload(name, dec, ha0, t0)}
+        scope.goto(msg)
+        time_altaz = {}
+        timestamps = t0 + 30.0*np.arange(20)
+        alt, az = star_altaz(timestamps, dec, ha0, t0)
+        for tstmp, altdeg, azdeg in zip(timestamps, alt, az):
+            time_altaz[tstmp] = (altdeg, azdeg)
+        timestamps = list(time_altaz)
+
+        # goto latency is the time from the payload being received to the curves being ready for tracking
+        def legacy_goto():
+            legacy_createcurves(time_altaz)
+        new_time = _timeit(lambda: scope.goto(msg), repeat)
+        old_time = _timeit(legacy_goto, repeat) + new_time - _timeit(lambda: telescope.QuadraticInterpolator(timestamps, alt, az), repeat)
+
+        # compare the two fits every second over the tracking period
+        old_curves = legacy_createcurves(time_altaz)
+        old_times = sorted(old_curves)
+
+        def legacy_alt_az(tstmp):
+            curvetime = max(ct for ct in old_times if tstmp >= ct)
+            popt_alt, popt_az = old_curves[curvetime]
+            return telescope._qcurve(tstmp, *popt_alt), telescope._qcurve(tstmp, *popt_az) % 360.0
+
+        maxdiff = 0.0
+        for tstmp in np.arange(t0, t0 + 570.0, 1.0):
+            old_alt, old_az = legacy_alt_az(tstmp)
+            new_alt, new_az = scope.target_alt_az(tstmp)
+            maxdiff = max(maxdiff, abs(old_alt - new_alt), _angle_error(old_az, new_az))
+        # and compare both fits with the source points
+        old_err = 0.0
+        new_err = 0.0
+        for tstmp, altdeg, azdeg in zip(timestamps, alt, az):
+            old_alt, old_az = legacy_alt_az(tstmp)
+            new_alt, new_az = scope.target_alt_az(tstmp)
+            old_err = max(old_err, abs(altdeg - old_alt), _angle_error(azdeg, old_az))
+            new_err = max(new_err, abs(altdeg - new_alt), _angle_error(azdeg, new_az))
+        print("%-20s %14.3f %14.3f %14.2e %14.2e %14.2e" % (name, old_time*1000, new_time*1000, maxdiff, old_err, new_err))
+
+
+def bench_lookup(repeat=20000):
+    """Compares the per tick cost of reading the target from the trajectory table with
+       selecting a curve by bisect and evaluating it, for tracks of increasing length"""
+    t0 = time.time()
+    name, dec, ha0 = TRACKS[1]
+    scope = simulate.SimTelescope(MemoryRedis(), {})
+    print("%-8s %8s %14s %14s %16s" % ("points", "curves", "curve tick us", "table tick us", "max difference"))
+    for points in (20, 120, 1200):
+        timestamps = t0 + 30.0*np.arange(points)
+        alt, az = star_altaz(timestamps, dec, ha0, t0)
+        scope.goto({'data': payload.encode(name, 1.0, dec, timestamps, alt, az)})
+        curves = scope.curves
+        ticks = [ t0 + (timestamps[-1] - t0)*n/repeat for n in range(repeat) ]
+        curve_time = _timeit(lambda: [ curves.at(tstmp) for tstmp in ticks ], 1)/repeat
+        table_time = _timeit(lambda: [ scope.trajectory.at(tstmp) for tstmp in ticks ], 1)/repeat
+        maxdiff = 0.0
+        for tstmp in ticks:
+            curve_alt, curve_az = curves.at(tstmp)
+            table_alt, table_az = scope.trajectory.at(tstmp)[:2]
+            maxdiff = max(maxdiff, abs(curve_alt - table_alt), _angle_error(curve_az, table_az))
+        print("%-8s %8s %14.2f %14.2f %16.2e" % (points, len(curves), curve_time*1e6, table_time*1e6, maxdiff))
+
+
+def bench_decode(repeat=2000):
+    """Times decoding of track payloads of increasing size, legacy, float64 and float32,
+       and checks the decoded points against the encoded values"""
+    t0 = time.time()
+    name, dec, ha0 = TRACKS[1]
+    print("%-8s %8s %8s %12s" % ("points", "format", "bytes", "decode us"))
+    data = legacy_payload(name, dec, ha0, t0)
+    print("%-8s %8s %8s %12.2f" % (20, "legacy", len(data), _timeit(lambda: payload.decode(data), repeat)*1e6))
+    for points in (20, 200, 2000, 20000):
+        timestamps = t0 + 3.0*np.arange(points)
+        alt, az = star_altaz(timestamps, dec, ha0, t0)
+        for float32 in (False, True):
+            data = payload.encode("Orion Nebula M42", 83.82, -5.39, timestamps, alt, az, float32)
+            track = payload.decode(data)
+            error = max(np.abs(track.times - timestamps).max(), np.abs(track.alts - alt).max(), np.abs(track.azs - az).max())
+            assert error < (1e-3 if float32 else 1e-9), error
+            print("%-8s %8s %8s %12.2f" % (points, "float32" if float32 else "float64", len(data),
+                                           _timeit(lambda: payload.decode(data), repeat)*1e6))
+
+
+def bench_interpolators(repeat=200):
+    """For each interpolator, reports the build time, evaluation time per timestamp as a vector of
+       ticks and as a single lookup, and the maximum error against the source points, and against
+       the true position between the points"""
+    t0 = time.time()
+    interpolators = [ telescope.QuadraticInterpolator, telescope.HermiteInterpolator, telescope.SplineInterpolator ]
+    print("%-20s %-22s %10s %12s %12s %14s %14s" % ("track", "interpolator", "build us", "vector us/pt",
+                                                     "single us", "err at points", "err between"))
+    for name, dec, ha0 in TRACKS:
+        timestamps = t0 + 30.0*np.arange(20)
+        alt, az = star_altaz(timestamps, dec, ha0, t0)
+        ticks = np.arange(timestamps[0], timestamps[-1], 0.5)
+        true_alt, true_az = star_altaz(ticks, dec, ha0, t0)
+        for interpolator in interpolators:
+            build = _timeit(lambda: interpolator(timestamps, alt, az), repeat)
+            curves = interpolator(timestamps, alt, az)
+            vector = _timeit(lambda: curves.evaluate(ticks), repeat)/len(ticks)
+            single = _timeit(lambda: curves.at(ticks[100]), repeat*10)
+            point_alt, point_az = curves.evaluate(timestamps)[:2]
+            point_err = max(np.abs(point_alt - alt).max(), _angle_error(point_az, az).max())
+            tick_alt, tick_az = curves.evaluate(ticks)[:2]
+            tick_err = max(np.abs(tick_alt - true_alt).max(), _angle_error(tick_az, true_az).max())
+            print("%-20s %-22s %10.1f %12.3f %12.2f %14.2e %14.2e" % (name, interpolator.__name__, build*1e6, vector*1e6,
+                                                                     single*1e6, point_err, tick_err))
+
+
+def bench_simulation(hours=2.0):
+    """Runs goto and track, and altaz, scenarios in simulation, reporting the control loop
+       throughput, tracking errors and limit hits"""
+    print("%-34s %10s %12s %12s %12s %12s %12s" % ("scenario", "ticks", "ticks/s", "rms err", "max err",
+                                                   "speed limit", "accn limit"))
+    for name, dec, ha0 in TRACKS:
+        sim = simulate.Simulation(alt=10.0, az=10.0)
+        sim.goto(dec, ha0, name)
+        start = time.perf_counter()
+        sim.run(hours*3600)
+        elapsed = time.perf_counter() - start
+        # tracking errors after two minutes, allowing for the initial slew
+        result = sim.summary(settle=120)
+        print("%-34s %10d %12.0f %12.2e %12.2e %12d %12d" % ("goto, track: " + name, result['ticks'], result['ticks']/elapsed,
+                                                             max(result['error_alt_rms'], result['error_az_rms']),
+                                                             max(result['error_alt_max'], result['error_az_max']),
+                                                             result['speed_at_limit'], result['acceleration_at_limit']))
+    sim = simulate.Simulation(alt=10.0, az=10.0)
+    start = time.perf_counter()
+    for n in range(int(hours*12)):
+        # a new altaz every five minutes
+        sim.altaz(20.0 + 50.0*(n % 2), (n*77.0) % 360.0)
+        sim.run(300)
+    elapsed = time.perf_counter() - start
+    result = sim.summary()
+    print("%-34s %10d %12.0f %12s %12s %12d %12d" % ("altaz every 5 minutes", result['ticks'], result['ticks']/elapsed,
+                                                     "-", "-", result['speed_at_limit'], result['acceleration_at_limit']))
+
+
+def check_speed(samples=200000):
+    """Checks, over random positions and speeds, that the speed and acceleration limits of get_speeds
+       hold, and that get_speeds, get_speed and the iterative speed limit loop agree, raising
+       AssertionError if not. Run on its own with python3 benchmark.py checkspeed"""
+    scope = simulate.SimTelescope(MemoryRedis(), {})
+    rng = np.random.default_rng(1)
+    # positions anywhere, with targets moving up to 2 degrees an interval, and speeds up to the maximum
+    current = rng.uniform(-90.0, 360.0, (samples, 2))
+    old_target = np.where(rng.random((samples, 2)) < 0.5, rng.uniform(0.0, 360.0, (samples, 2)),
+                          (current + rng.normal(0.0, 1.0, (samples, 2))) % 360.0)
+    target = (old_target + rng.uniform(-2.0, 2.0, (samples, 2))) % 360.0
+    speed = rng.uniform(-scope.MAX_SPEED, scope.MAX_SPEED, (samples, 2))
+
+    # the limits, checked with one vectorized call over all samples
+    new_speed = scope.get_speeds(current, speed, old_target, target)
+    acceleration = np.abs(new_speed - speed)/scope.interval
+    assert np.abs(new_speed).max() <= scope.MAX_SPEED*(1 + 1e-12), np.abs(new_speed).max()
+    assert acceleration.max() < scope.MAX_ACCELERATION, acceleration.max()
+    # and against the iterative loop, for a subset
+    check = min(samples, 20000)
+    legacy = np.array([ [ legacy_get_speed(scope, current[n, axis], speed[n, axis], old_target[n, axis], target[n, axis])
+                          for axis in (0, 1) ] for n in range(check) ])
+    scalar = np.array([ [ scope.get_speed(current[n, axis], speed[n, axis], old_target[n, axis], target[n, axis])
+                          for axis in (0, 1) ] for n in range(check) ])
+    maxdiff = max(np.abs(legacy - new_speed[:check]).max(), np.abs(legacy - scalar).max())
+    assert maxdiff < 1e-9, maxdiff
+    print("%s random samples, max speed %.6f, max acceleration %.6f, max difference from loop %.2e" % (
+          samples, np.abs(new_speed).max(), acceleration.max(), maxdiff))
+
+
+def bench_speed(repeat=20000):
+    """Compares the per tick cost of the iterative speed limit loop with the closed form of get_speed,
+       and of get_speeds for both axes, the results are checked by check_speed"""
+    scope = simulate.SimTelescope(MemoryRedis(), {})
+
+    # per tick timing, for a large error, where the loop repeats many times, and when tracking
+    print("%-24s %14s %14s %14s %16s" % ("case", "loop tick us", "closed tick us", "vector tick us", "max difference"))
+    for case, args in (("slewing, reversing", ((10.0, 10.0), (-4.0, -4.0), (80.0, 200.0), (80.1, 200.1))),
+                       ("tracking", ((45.0, 180.0), (0.004, 0.004), (45.001, 180.001), (45.003, 180.003)))):
+        current_pos, speeds, old_targets, targets = args
+        loop_time = _timeit(lambda: [ legacy_get_speed(scope, *axis) for axis in zip(*args) ], repeat)
+        closed_time = _timeit(lambda: [ scope.get_speed(*axis) for axis in zip(*args) ], repeat)
+        vector_time = _timeit(lambda: scope.get_speeds(*args).tolist(), repeat)
+        difference = max(abs(legacy_get_speed(scope, *axis) - scope.get_speed(*axis)) for axis in zip(*args))
+        print("%-24s %14.2f %14.2f %14.2f %16.2e" % (case, loop_time*1e6, closed_time*1e6, vector_time*1e6, difference))
+
+
+def bench_motors(hours=1.0):
+    """Tracks each target in simulation, driving the simulated motors by set_rate each tick, reporting the
+       ticks, the changes made to the simulated gpio outputs, and whether the final direction and duty
+       cycle of each motor match the final speed of its axis"""
+    print("%-20s %8s %8s %8s %10s" % ("track", "axis", "ticks", "gpio", "matches"))
+    for name, dec, ha0 in TRACKS:
+        sim = simulate.Simulation(alt=10.0, az=10.0)
+        sim.goto(dec, ha0, name)
+        sim.run(hours*3600)
+        scope = sim.scope
+        for axis, motor, speed in (('alt', scope.motor1, scope.speed_alt), ('az', scope.motor2, scope.speed_az)):
+            duty_cycle = motor.duty_cycle_for(speed)
+            clockwise = speed > 0.0
+            matches = (motor.duty_cycle == duty_cycle) and (not duty_cycle or motor.pwm.direction == clockwise)
+            print("%-20s %8s %8d %8d %10s" % (name, axis, scope.ticker.ticks, motor.pwm.changes, matches))
+
+
+def bench_selftest(seconds=5.0):
+    """Runs the Telescope selftest in real time, tracking a target, at each of its candidate intervals,
+       with telemetry written to an in-memory redis by the background writer. The motors are simulated,
+       so the benchmark does not drive the mount when run on the Pi"""
+    scope = type('Scope', (telescope.Telescope,), {'SIMULATE_MOTORS': True})(MemoryRedis(), {})
+    t0 = time.time()
+    name, dec, ha0 = TRACKS[1]
+    scope.goto({'data': simulate.star_payload(name, dec, ha0, t0, t0)})
+    scope.fitter.join()
+    print("%10s %10s %12s %12s %10s" % ("interval", "rate", "tick p50 ms", "tick p99 ms", "overruns"))
+    for result in scope.selftest(seconds):
+        print("%10s %10.3f %12.3f %12.3f %10d" % (result['interval'], result['rate'], result['tick_p50_ms'],
+                                                  result['tick_p99_ms'], result['overruns']))
+
+
+BENCHMARKS = { 'fit': bench_fit,
+               'motors': bench_motors,
+               'sim': bench_simulation,
+               'interp': bench_interpolators,
+               'lookup': bench_lookup,
+               'decode': bench_decode,
+               'speed': bench_speed,
+               'checkspeed': check_speed,
+               'selftest': bench_selftest }
+
+
+if __name__ == "__main__":
+
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark %s, choose from %s" % (name, ", ".join(sorted(BENCHMARKS))))
+            sys.exit(1)
+        print("\n%s\n" % (name,))
+        BENCHMARKS[name]()
@@ -0,0 +1,169 @@
+################################################################
+#
+# This module defines a Dispatcher, which handles redis pubsub
+# messages as they arrive, and records their latency
+#
+################################################################
+
+import time, logging
+from bisect import bisect_left
+
+
+# The Dispatcher blocks on the pubsub socket, so each message is handled as soon as it is
+# received, rather than waiting for the next poll, and the process sleeps while idle. The
+# socket read times out every TIMEOUT seconds so the dispatcher can send its probe and
+# publish its statistics.
+
+# For each channel a LatencyHistogram records the time from the message being read to its
+# handler returning. The time from publishing to the message being read, which a polling loop
+# lengthens, cannot be measured for messages from other processes, so the dispatcher publishes
+# its own probe message every PROBE_INTERVAL seconds, holding its monotonic send time, and
+# records the time to receiving it under the probe channel.
+
+# The histograms are published to the redis hash rempi01_pubsub_stats every STATS_INTERVAL
+# seconds, as fields channel_count, channel_p50_ms, channel_p99_ms, channel_max_ms, and
+# channel_hist, the counts per bucket, and are then reset.
+
+
+class LatencyHistogram(object):
+
+    # upper bounds of the buckets in milliseconds, a final bucket holds anything longer
+    BOUNDS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        "Empties the histogram"
+        self.counts = [0]*(len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+
+    def record(self, seconds):
+        "Records a latency given in seconds"
+        ms = seconds*1000.0
+        self.counts[bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        if ms > self.max:
+            self.max = ms
+
+
+    def percentile(self, percent):
+        """Returns the upper bound in milliseconds of the bucket holding the given percentile, or the
+           maximum if that is in the final bucket, or is less than the bound"""
+        if not self.count:
+            return 0.0
+        needed = self.count*percent/100.0
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= needed:
+                break
+        if index == len(self.BOUNDS):
+            return self.max
+        return min(self.BOUNDS[index], self.max)
+
+
+    def stats(self, name):
+        "Returns a dictionary of the statistics, with keys prefixed by name"
+        return { name+'_count': self.count,
+                 name+'_p50_ms': round(self.percentile(50), 3),
+                 name+'_p99_ms': round(self.percentile(99), 3),
+                 name+'_max_ms': round(self.max, 3),
+                 name+'_hist': ",".join(str(count) for count in self.counts) }
+
+
+class Dispatcher(object):
+
+    TIMEOUT = 1.0 # seconds, the longest the dispatcher blocks waiting for a message
+
+    PROBE_CHANNEL = 'pubsubprobe' # channel of the probe messages sent by the dispatcher to itself
+
+    PROBE_INTERVAL = 10.0 # seconds between probe messages
+
+    STATS_INTERVAL = 60.0 # seconds between publishing the histograms to redis
+
+    STATS_KEY = 'rempi01_pubsub_stats'
+
+    def __init__(self, rconn, monotonic=time.monotonic):
+        self.rconn = rconn
+        self.monotonic = monotonic
+        self.pubsub = rconn.pubsub(ignore_subscribe_messages=True)
+        # handlers and histograms, keyed by channel name as bytes, as the name in a message
+        self.handlers = {}
+        self.histograms = {}
+        self.probe = LatencyHistogram()
+        # count of handlers raising an exception
+        self.errors = 0
+        self.pubsub.subscribe(self.PROBE_CHANNEL)
+
+
+    def subscribe(self, **channels):
+        "Subscribes to each channel, with its handler, called with the message, as pubsub.subscribe"
+        self.pubsub.subscribe(*channels)
+        for channel, handler in channels.items():
+            self.handlers[channel.encode("utf-8")] = handler
+            self.histograms[channel.encode("utf-8")] = LatencyHistogram()
+
+
+    def handle(self, message):
+        "Calls the handler of the message channel, and records the time taken"
+        channel = message['channel']
+        if channel == self.PROBE_CHANNEL.encode("utf-8"):
+            try:
+                self.probe.record(self.monotonic() - float(message['data']))
+            except ValueError:
+                pass
+            return
+        handler = self.handlers.get(channel)
+        if handler is None:
+            return
+        received = self.monotonic()
+        try:
+            handler(message)
+        except Exception:
+            # log and continue, so one failing handler does not stop the dispatcher
+            self.errors += 1
+            logging.exception('Failed to handle message on channel %s' % (channel.decode("utf-8"),))
+        self.histograms[channel].record(self.monotonic() - received)
+
+
+    def stats(self):
+        "Returns a dictionary of the statistics of the probe and of each channel"
+        stats = self.probe.stats(self.PROBE_CHANNEL)
+        for channel, histogram in self.histograms.items():
+            if histogram.count:
+                stats.update(histogram.stats(channel.decode("utf-8")))
+        stats['errors'] = self.errors
+        return stats
+
+
+    def reset_stats(self):
+        "Resets the histograms and error count"
+        self.probe.reset()
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.errors = 0
+
+
+    def __call__(self):
+        "Handles messages as they arrive, this is a blocking call which does not return"
+        now = self.monotonic()
+        next_probe = now
+        next_stats = now + self.STATS_INTERVAL
+        while True:
+            now = self.monotonic()
+            if now >= next_probe:
+                self.rconn.publish(self.PROBE_CHANNEL, repr(now))
+                next_probe = now + self.PROBE_INTERVAL
+            if now >= next_stats:
+                self.rconn.delete(self.STATS_KEY)
+                self.rconn.hset(self.STATS_KEY, mapping=self.stats())
+                self.reset_stats()
+                next_stats = now + self.STATS_INTERVAL
+            # blocks until a message arrives, or the time of the next probe or publication
+            message = self.pubsub.get_message(timeout=max(min(next_probe, next_stats, now + self.TIMEOUT) - now, 0.0))
+            if message:
+                self.handle(message)
@@ -0,0 +1,63 @@
+################################################################
+#
+# This module defines a FitWorker, which fits curves to goto
+# and track payloads away from the threads receiving them
+#
+################################################################
+
+import threading, queue, logging
+
+# A goto or track payload is received on the redis pubsub thread, fitting curves to it
+# there would hold up every other control channel, and fitting on the control loop thread
+# would lengthen its tick. The FitWorker instead passes each job to its own thread, which
+# calls the build function with it. Jobs are run in the order they are submitted.
+
+# If background is False, jobs are run by submit, in the calling thread, as is done in
+# simulation so results are repeatable.
+
+
+class FitWorker(object):
+
+    def __init__(self, build, background=True):
+        "build is called with the arguments of each job submitted"
+        self.build = build
+        self.background = background
+        # counts of jobs run, and of those which raised an exception
+        self.jobs = 0
+        self.errors = 0
+        if background:
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name='fit', daemon=True)
+            self._worker.start()
+
+
+    def submit(self, *args):
+        "Submits a job, build(*args) is called by the worker"
+        if self.background:
+            self._queue.put(args)
+        else:
+            self._call(args)
+
+
+    def join(self):
+        "Blocks until all submitted jobs have been run"
+        if self.background:
+            self._queue.join()
+
+
+    def _call(self, args):
+        "Runs a job, logging any exception so the worker continues"
+        try:
+            self.build(*args)
+        except Exception:
+            self.errors += 1
+            logging.exception('Failed to fit track data')
+        self.jobs += 1
+
+
+    def _run(self):
+        "The worker thread, runs jobs as they are submitted"
+        while True:
+            args = self._queue.get()
+            self._call(args)
+            self._queue.task_done()
@@ -67,18 +67,53 @@ def initial_setup_outputs():
     return True
 
 
-def makepwm(name):
-    "create a pwm instance, name should be motor1pwm etc.,"
-    if not _gpio_control:
-        return
+def makepwm(name, simulate=False):
+    """create a pwm instance, name should be motor1pwm etc., if simulate is True
+       a SimulatedPWM is returned, which does not need the Pi"""
     if name not in _OUTPUTS:
         return
     if _OUTPUTS[name][0] != 'pwm':
         return
+    if simulate:
+        return SimulatedPWM(name, 600)
+    if not _gpio_control:
+        return
     pin = _OUTPUTS[name][2]
     return GPIO.PWM(pin, 600)   # 600 is the frequency in hz
 
 
+class SimulatedPWM(object):
+    """Stands in for an RPi.GPIO PWM instance off the Pi, holding the duty cycle, and the
+       direction output of its motor, and counting the changes made to them"""
+
+    def __init__(self, name, frequency):
+        self.name = name
+        self.frequency = frequency
+        self.running = False
+        self.duty_cycle = 0.0
+        self.direction = get_boolean_power_on_value(name.replace('pwm', 'direction'))
+        # the number of calls which would have touched the gpio
+        self.changes = 0
+
+    def start(self, duty_cycle):
+        self.running = True
+        self.duty_cycle = duty_cycle
+        self.changes += 1
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.changes += 1
+
+    def stop(self):
+        self.running = False
+        self.changes += 1
+
+    def set_direction(self, value):
+        "Sets the direction output, True for clockwise"
+        self.direction = value
+        self.changes += 1
+
+
 
 
 def get_boolean_output(name):
@@ -5,96 +5,267 @@
 #
 ################################################################
 
-import time, threading, logging
+import time, threading, queue, logging, math
+
+import numpy as np
 
 from . import hardware
 
 
+# A motor run is a profile of duty cycles, ramping up over the ramp time, holding at the
+# given speed, and ramping down to stop at the end of the duration. If the duration is less
+# than two ramps, the speed peaks at half the duration. The profile is built once for each
+# run as the times at which the duty cycle changes, the duty cycle being set in steps of
+# DUTY_STEP, so the motor thread only wakes to make a change, and sleeps until the next.
+# Only the ramps are evaluated, the hold between them is a single change, so the cost of
+# building a profile does not grow with the duration.
+
+# the shape of a ramp is a function of the fraction s of the ramp time, from 0 to 1, returning
+# the fraction of the speed, from 0 to 1
+
+LINEAR = 'linear'     # constant acceleration, with steps in acceleration at the start and end of the ramp
+SCURVE = 'scurve'     # smoothstep, the acceleration rises and falls, so there are no steps in acceleration
+SINE = 'sine'         # half a cosine wave, an S-curve with a gentler start and end
+QUARTIC = 'quartic'   # the original fitted quartic motor curve, stretched to the ramp time
+
+
+def _quartic(s):
+    "The original motor curve, a quartic fitted to rise from 0 to 1 over 8 seconds, for s from 0 to 1"
+    t = 8.0*s
+    y = -0.0540937 + 0.330319*t - 0.0383795*t*t + 0.00218635*t*t*t - 5.46589e-05*t*t*t*t
+    return np.where(s >= 1.0, 1.0, np.clip(y, 0.0, 1.0))
+
+
+SHAPES = { LINEAR: lambda s: s,
+           SCURVE: lambda s: s*s*(3.0 - 2.0*s),
+           SINE: lambda s: 0.5 - 0.5*np.cos(np.pi*s),
+           QUARTIC: _quartic }
+
+# the ramps are evaluated at this resolution, in seconds, and the duty cycle rounded to DUTY_STEP
+RESOLUTION = 0.01
+DUTY_STEP = 1.0
+
+
+def profile(duration, speed, ramp=8.0, shape=QUARTIC, initial=0.0):
+    """Returns numpy arrays times, duty_cycles, of the times in seconds from the start of a run of the
+       given duration, at which the duty cycle changes, and the duty cycle from each time. speed is
+       the maximum duty cycle, ramp the acceleration and deceleration time in seconds and shape one of
+       SHAPES. initial is the duty cycle at the start, for a motor already running, from which the
+       speed is blended, taking the part of the ramp time for the change of speed.
+       The first time is zero, and the last is the duration, with duty cycle zero"""
+    if shape not in SHAPES:
+        raise ValueError("shape should be one of %s" % (", ".join(sorted(SHAPES)),))
+    top = max(speed, initial)
+    if (ramp > 0.0) and (top > 0.0):
+        blend = ramp*abs(speed - initial)/top
+        # the times of the blend from the start, and of the final ramp, with the start of the hold between them
+        t = np.concatenate(([0.0, blend], np.arange(0.0, min(blend, duration), RESOLUTION),
+                            np.arange(max(duration - ramp, 0.0), duration, RESOLUTION)))
+        t = np.unique(t[t < duration])
+        # the levels blending from initial to speed, up or down, and ramping down from the top speed to
+        # stop at duration, the lesser applies
+        rising = initial + (speed - initial)*SHAPES[shape](np.clip(t/blend, 0.0, 1.0) if blend else np.ones_like(t))
+        falling = top*SHAPES[shape](np.clip((duration - t)/ramp, 0.0, 1.0))
+        level = np.minimum(rising, falling)
+    else:
+        t = np.zeros(1)
+        level = np.full_like(t, speed)
+    duty_cycles = np.round(level/DUTY_STEP)*DUTY_STEP
+    # the indices at which the duty cycle changes, the first is always included
+    changes = np.flatnonzero(np.diff(duty_cycles, prepend=np.nan))
+    times = np.append(t[changes], duration)
+    duty_cycles = np.append(duty_cycles[changes], 0.0)
+    return times, duty_cycles
+
+
+# Each Motor has one worker thread, started with its first command, which runs the motor.
+# Commands are put on a queue, and the worker waits on the queue until the time of the next
+# change of duty cycle, so a new command is taken at once, preempting the current run:
+
+# a run in the same direction as the motor is running blends from the current duty cycle
+# into the new speed, and then runs for the new duration
+
+# a run in the opposite direction first ramps down to stop, then changes direction
+
+# STOP stops the motor immediately
+
+# The motor can also be driven continuously by set_rate, as the Telescope control loop does
+# each tick, in-process. The signed rate, in degrees per second, positive clockwise, is mapped
+# to a direction and a duty cycle by the calibration table of the motor. The outputs are only
+# touched when the direction or duty cycle changes, and changes are applied at most every
+# MIN_UPDATE seconds, except stopping, which is done at once. A reversal, as in a timed run,
+# never switches the direction at speed, the motor is first stopped, and is started in the
+# new direction by a later call, at least MIN_UPDATE seconds after. A timed run takes
+# precedence, set_rate is ignored until it completes.
+
+# The state of the motor is held in memory, and written to redis key name+"status" as it
+# changes, for display. A motor of the Telescope writes it through the TelemetryWriter of the
+# control loop, so set_rate makes no redis call, and a redis failure cannot end the loop.
+
+STOPPED = 'STOPPED'
+CLOCKWISE = 'CLOCKWISE'
+ANTICLOCKWISE = 'ANTICLOCKWISE'
+STOP = 'STOP'
+
 
 class Motor(object):
 
-    @staticmethod
-    def curve(t, duration):
-        """Returns a value between 0 and 1.0 for a given t between 0 and duration
-           with an eight second acceleration and deceleration
-           For t from 0 to 8 increases from 0 up to 1.0
-           For t from duration-8 to duration decreases to 0"""
-        if t >= duration:
-            return 0.0
-        half = duration/2.0
-        if t<=half:
-            # for the first half of duration, increasing speed to a maximum of 1.0 after 8 seconds
-            if t>8.0:
-                return 1.0
-        else:
-            # for the second half of duration, decreasing speed to zero when there are 8 seconds left
-            if duration-t>8.0:
-                return 1.0
-            t = 20 - (duration-t)
-
-        # This curve is a fit increasing to 1 (or at least near to 1) with t from 0 to 8,
-        # and decreasing with t from 12 to 20
-        a = -0.0540937
-        b = 0.330319
-        c = -0.0383795
-        d = 0.00218635
-        e = -5.46589e-05
-        y = a + b*t + c*t*t + d*t*t*t + e*t*t*t*t
-        if y < 0.0:
-            return 0.0
-        if y > 1.0:
-            return 1.0
-        return round(y, 3)
+    RAMP = 8.0 # seconds of acceleration and deceleration, unless set in redis key name+"ramp"
 
+    SHAPE = QUARTIC # the shape of the ramps, unless set in redis key name+"shape"
 
-    def __init__(self, name, rconn):
+    # The calibration table, pairs of (rate in degrees per second, duty cycle) in increasing order,
+    # duty cycles are interpolated between them. Rates below the first do not turn the motor, and
+    # give a duty cycle of zero, rates above the last give its duty cycle. These values should be
+    # measured for each motor and gearing, and given as the calibration argument of the Motor
+    CALIBRATION = ((0.002, 12.0), (0.05, 20.0), (0.5, 35.0), (2.0, 65.0), (4.0, 100.0))
+
+    MIN_UPDATE = 0.1 # minimum seconds between changes by set_rate, other than stopping
+
+    def __init__(self, name, rconn, calibration=None, simulate=False, telemetry=None):
+        """calibration is a table of (rate, duty cycle) pairs as CALIBRATION, the default, if simulate
+           is True the pwm and direction outputs are a hardware.SimulatedPWM. telemetry is normally
+           the TelemetryWriter of the control loop, through which the status is written to redis"""
         self.name = name
-        self.pwm = hardware.makepwm(name+'pwm') # for example 'motor1pwm'
-        self.running = time.time()
+        self.pwm = hardware.makepwm(name+'pwm', simulate) # for example 'motor1pwm'
         self.statuskey = name + 'status'  # for example 'motor1status'
         # info stored to redis
         self.rconn = rconn
+        # if None, the status is written to redis directly
+        self.telemetry = telemetry
+        # the state of the motor, status is STOPPED, CLOCKWISE or ANTICLOCKWISE, and the duty cycle
+        self.status = STOPPED
+        self.duty_cycle = 0.0
+        # the direction output last set, None if not yet set
+        self.direction = None
         # Initial start with motors stopped
-        rconn.set(self.statuskey, 'STOPPED')
+        rconn.set(self.statuskey, STOPPED)
+        # the calibration table as arrays of rates and duty cycles
+        if calibration is None:
+            calibration = self.CALIBRATION
+        self.rates, self.duty_cycles = (np.array(column, dtype=float) for column in zip(*calibration))
+        # set while the worker is running a timed run
+        self.timed = False
+        # counts of set_rate calls, of those changing the outputs, and of those
+        # not doing so as the output was unchanged, or was changed too recently
+        self.rate_calls = 0
+        self.rate_updates = 0
+        self.rate_unchanged = 0
+        self.rate_limited = 0
+        # the monotonic time of the last change of duty cycle by set_rate
+        self._rate_updated = None
+        # commands for the worker thread, which is started by the first command
+        self._commands = queue.Queue()
+        self._worker = None
+        # held while the outputs are changed, by the worker or set_rate
+        self._lock = threading.Lock()
 
 
     def __call__(self, msg):
-        "Handles the pubsub msg"
-        motorstatus = self.rconn.get(self.statuskey)
-        if motorstatus != b"STOPPED":
-            # can only move if the motor is stopped
-            return
+        "Handles the pubsub msg, CLOCKWISE or ANTICLOCKWISE to run the motor, or STOP"
         try:
             direction = msg['data'].decode("utf-8")
+        except:
+            return
+        if direction == STOP:
+            logging.info(self.name + " stop requested")
+            self.command(STOP)
+            return
+        if direction not in (CLOCKWISE, ANTICLOCKWISE):
+            return
+        try:
             duration = self.rconn.get(self.name+"duration")
             duration = float(duration)
             speed = self.rconn.get(self.name+"speed")
             speed = int(speed)
+            ramp = self.rconn.get(self.name+"ramp")
+            ramp = self.RAMP if ramp is None else float(ramp)
+            shape = self.rconn.get(self.name+"shape")
+            shape = self.SHAPE if shape is None else shape.decode("utf-8")
         except:
             # input values malformed
             return
+        if shape not in SHAPES:
+            return
         if duration <= 0:
             return
         if speed <= 0:
             return
         if speed > 100.0:
             speed = 100.0
-        # record time at which this method was called
-        self.running = time.time()
-        if direction == "CLOCKWISE":
-            self.rconn.set(self.statuskey, 'CLOCKWISE')
-            logging.info(self.name + " started, clockwise, duration: %s, speed: %s" % (duration,speed))
-            if self.pwm is not None:
-                hardware.set_boolean_output(self.name+'direction', True) # for example 'motor1direction'
-            run_clockwise = threading.Thread(target=self.runmotor, args=(duration,speed))
-            run_clockwise.start()
-        if direction == "ANTICLOCKWISE":
-            self.rconn.set(self.statuskey, 'ANTICLOCKWISE')
-            logging.info(self.name + " started, anticlockwise, duration: %s, speed: %s" % (duration,speed))
-            if self.pwm is not None:
-                hardware.set_boolean_output(self.name+'direction', False) # for example 'motor1direction'
-            run_anticlockwise = threading.Thread(target=self.runmotor, args=(duration,speed))
-            run_anticlockwise.start()
+        logging.info(self.name + " %s, duration: %s, speed: %s" % (direction.lower(), duration, speed))
+        self.command(direction, duration, speed, ramp, shape)
+
+
+    def command(self, direction, duration=0.0, speed=0.0, ramp=None, shape=None):
+        """Puts a command on the queue of the worker thread, direction is CLOCKWISE or ANTICLOCKWISE
+           to run the motor for duration seconds at speed, preempting any current run, or STOP"""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+        self._commands.put((direction, duration, speed, ramp, shape))
+
+
+    def duty_cycle_for(self, rate):
+        """Returns the duty cycle for the given rate in degrees per second, of either sign, from the calibration
+           table, a rate which is not finite gives a duty cycle of zero, so stops the motor"""
+        rate = abs(rate)
+        if not math.isfinite(rate) or rate < self.rates[0]:
+            return 0.0
+        duty_cycle = float(np.interp(rate, self.rates, self.duty_cycles))
+        return round(duty_cycle/DUTY_STEP)*DUTY_STEP
+
+
+    def set_rate(self, rate, now=None):
+        """Drives the motor at rate degrees per second, positive clockwise, negative anticlockwise, now is
+           the monotonic time, by default time.monotonic(). Returns True if the outputs were changed"""
+        self.rate_calls += 1
+        duty_cycle = self.duty_cycle_for(rate)
+        if not duty_cycle:
+            direction = STOPPED
+        elif rate > 0.0:
+            direction = CLOCKWISE
+        else:
+            direction = ANTICLOCKWISE
+        if self.timed:
+            return False
+        if (direction == self.status) and (duty_cycle == self.duty_cycle):
+            self.rate_unchanged += 1
+            return False
+        if now is None:
+            now = time.monotonic()
+        if (direction != STOPPED) and (self._rate_updated is not None) and (now - self._rate_updated < self.MIN_UPDATE):
+            # stopping is done at once, other changes are limited
+            self.rate_limited += 1
+            return False
+        with self._lock:
+            if self.timed:
+                return False
+            if (direction == STOPPED) or (self.status != STOPPED and direction != self.status):
+                # stop, or if reversing, stop before the direction is changed by a later call
+                self._stop()
+            else:
+                self._drive(direction, duty_cycle)
+        self._rate_updated = now
+        self.rate_updates += 1
+        return True
+
+
+    def rate_stats(self):
+        "Returns a dictionary of the counts of set_rate calls, and their outcomes, prefixed with the motor name"
+        return { self.name+'_rate_calls': self.rate_calls,
+                 self.name+'_rate_updates': self.rate_updates,
+                 self.name+'_rate_unchanged': self.rate_unchanged,
+                 self.name+'_rate_limited': self.rate_limited }
+
+
+    def reset_rate_stats(self):
+        "Resets the counts of set_rate calls"
+        self.rate_calls = 0
+        self.rate_updates = 0
+        self.rate_unchanged = 0
+        self.rate_limited = 0
 
 
     def pin_changed(self,input_name):
@@ -102,36 +273,113 @@ class Motor(object):
         pass
 
 
-    def runmotor(self, duration, speed):
-        """Runs motor for duration seconds with the given max speed, with 8 seconds acceleration/deceleration"""
-        if duration <= 0:
+    def _set_status(self, status):
+        "Sets the status in memory, and in redis"
+        if status == self.status:
             return
-        if speed <= 0:
+        self.status = status
+        if self.telemetry is not None:
+            # written with the next flush of the control loop, so set_rate makes no redis round trip
+            self.telemetry.set(self.statuskey, status)
             return
-        if speed > 100.0:
-            speed = 100.0
-        # start
-        now = time.time()
-        t = 0
+        try:
+            self.rconn.set(self.statuskey, status)
+        except Exception:
+            # the status in memory is authoritative, redis only holds it for display
+            logging.error('Failed to write %s to redis' % (self.statuskey,))
+
+
+    def _set_direction(self, direction):
+        "Sets the direction output, if it has changed"
+        if direction == self.direction:
+            return
+        if isinstance(self.pwm, hardware.SimulatedPWM):
+            self.pwm.set_direction(direction == CLOCKWISE)
+        elif self.pwm is not None:
+            # for example 'motor1direction'
+            hardware.set_boolean_output(self.name+'direction', direction == CLOCKWISE)
+        self.direction = direction
+
+
+    def _drive(self, direction, duty_cycle):
+        "Runs the motor in direction, CLOCKWISE or ANTICLOCKWISE, at duty_cycle, changing only the outputs which differ"
+        self._set_direction(direction)
         if self.pwm is not None:
-            self.pwm.start(0.0)
-        duty_cycle = 0
-        # obtain dc which is a value between 0 and speed for the duration
-        while t <= duration:
-            t = time.time() - now
-            dc = self.curve(t, duration) * speed
-            # for initial development, print the calculated duty cycle
-            print(dc)
-            if dc != duty_cycle:
-                # only do a change if the duty cycle has changed
-                duty_cycle = dc
-                if self.pwm is not None:
-                    # Note: the particular H bridge used does not accept a
-                    # duty cycle of 100, therefore this line reduces speed by 0.95
-                    out = round(duty_cycle * 0.95,2) 
-                    self.pwm.ChangeDutyCycle(out)
-            time.sleep(0.2)
+            if self.status == STOPPED:
+                self.pwm.start(0.0)
+            if duty_cycle != self.duty_cycle:
+                # Note: the particular H bridge used does not accept a
+                # duty cycle of 100, therefore this line reduces speed by 0.95
+                out = round(duty_cycle * 0.95,2) 
+                self.pwm.ChangeDutyCycle(out)
+        self.duty_cycle = duty_cycle
+        self._set_status(direction)
+
+
+    def _stop(self):
+        "Stops the motor"
         if self.pwm is not None:
+            self.pwm.ChangeDutyCycle(0.0)
             self.pwm.stop()
-        self.rconn.set(self.statuskey, 'STOPPED')
+        self.duty_cycle = 0.0
+        self._set_status(STOPPED)
+
+
+    def _plan(self, status, initial, direction, duration, speed, ramp, shape):
+        """Returns a list of (monotonic time, direction, duty cycle) of the changes to make for a run,
+           from the given status and duty cycle initial of the motor"""
+        if ramp is None:
+            ramp = self.RAMP
+        if shape is None:
+            shape = self.SHAPE
+        now = time.monotonic()
+        plan = []
+        if (status != STOPPED) and (direction != status) and initial:
+            # reversing, ramp down from the current duty cycle to stop, in the part of the ramp time for its speed
+            stopping = ramp*initial/100.0
+            times, duty_cycles = profile(stopping, initial, stopping, shape, initial)
+            plan.extend((now + change, status, dc) for change, dc in zip(times.tolist(), duty_cycles.tolist()))
+            now += stopping
+            initial = 0.0
+        times, duty_cycles = profile(duration, speed, ramp, shape, initial)
+        plan.extend((now + change, direction, dc) for change, dc in zip(times.tolist(), duty_cycles.tolist()))
+        return plan
+
 
+    def _run(self):
+        "The worker thread, runs the motor, taking commands from the queue"
+        plan = []
+        while True:
+            try:
+                if plan:
+                    # wait for a command until the time of the next change
+                    command = self._commands.get(timeout=max(plan[0][0] - time.monotonic(), 0.0))
+                else:
+                    command = self._commands.get()
+            except queue.Empty:
+                # no new command, make the next change
+                change, direction, dc = plan.pop(0)
+                with self._lock:
+                    if plan:
+                        self._drive(direction, dc)
+                    else:
+                        # the run is complete
+                        self._stop()
+                        self.timed = False
+                continue
+            direction, duration, speed, ramp, shape = command
+            plan = []
+            if direction != STOP:
+                with self._lock:
+                    # set_rate is excluded from now, so the state the plan starts from is not changed
+                    self.timed = True
+                    status, initial = self.status, self.duty_cycle
+                # the plan is built without holding the lock
+                try:
+                    plan = self._plan(status, initial, direction, duration, speed, ramp, shape)
+                except Exception:
+                    logging.exception(self.name + " command failed")
+            with self._lock:
+                if not plan:
+                    self._stop()
+                self.timed = bool(plan)
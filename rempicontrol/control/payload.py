@@ -0,0 +1,108 @@
+################################################################
+#
+# This module decodes the goto and track payloads sent by the
+# main server, which give the alt, az positions of a target
+#
+################################################################
+
+from struct import Struct, calcsize, pack
+
+from collections import namedtuple
+
+import numpy as np
+
+
+# The legacy payload is a 10 byte name, ra, dec and 20 sets of timestamp, alt, az,
+# packed as "10s"+"d"*62 in native byte order and alignment, so the floats start
+# after padding, at byte 16, and the payload is 512 bytes in total
+
+LEGACY_FORMAT = "10s"+"d"*62
+LEGACY_SIZE = calcsize(LEGACY_FORMAT)
+LEGACY_OFFSET = calcsize("10s0d")
+LEGACY_POINTS = 20
+
+# The versioned payload is a header, followed by the name, followed by the points
+
+# header, little endian
+#   magic      2s   b"RT"
+#   version    B    1
+#   flags      B    bit 0 set if the point values are float32, otherwise float64
+#   count      H    number of points
+#   namelength B    length of the utf-8 encoded name
+#   ra         d
+#   dec        d
+#   t0         d    unix timestamp from which the point times are measured
+# name         namelength bytes, utf-8
+# points       count sets of seconds from t0, alt, az as float32 or float64, little endian
+
+MAGIC = b"RT"
+VERSION = 1
+FLOAT32 = 0x01
+
+_HEADER = Struct("<2sBBHBddd")
+
+_DTYPES = { 0: np.dtype("<f8"), FLOAT32: np.dtype("<f4") }
+
+
+Track = namedtuple('Track', ['name', 'ra', 'dec', 'times', 'alts', 'azs'])
+Track.__doc__ = "A decoded payload, times, alts and azs are numpy arrays of the points"
+
+
+def decode(data):
+    """Returns a Track decoded from a versioned or legacy payload, raises ValueError if the
+       payload is not recognised, has fewer than three points, or has a value which is not finite.
+       Point values are read with numpy.frombuffer, so for float64 payloads alts and azs are views
+       of data rather than copies"""
+    data = memoryview(data)
+    # a legacy payload may also start with the magic, if the target name does, so it is only taken
+    # as versioned if the version is known and the length matches its header
+    reason = "Track payload of %s bytes not recognised" % (len(data),)
+    if (len(data) >= _HEADER.size) and (data[:2] == MAGIC):
+        magic, version, flags, count, namelength, ra, dec, t0 = _HEADER.unpack_from(data)
+        dtype = _DTYPES.get(flags & FLOAT32)
+        offset = _HEADER.size + namelength
+        if version != VERSION:
+            reason = "Track payload version %s not supported" % (version,)
+        elif len(data) == offset + count*3*dtype.itemsize:
+            if count < 3:
+                raise ValueError("Track payload has %s points, at least three are required" % (count,))
+            name = bytes(data[_HEADER.size:offset]).decode("utf-8")
+            points = np.frombuffer(data, dtype=dtype, count=count*3, offset=offset).reshape(count, 3)
+            times = t0 + points[:,0].astype(float)
+            return _finite(Track(name, ra, dec, times, points[:,1], points[:,2]))
+    if len(data) == LEGACY_SIZE:
+        name = bytes(data[:10]).rstrip(b'\x00').decode("utf-8")
+        values = np.frombuffer(data, dtype=float, offset=LEGACY_OFFSET)
+        points = values[2:].reshape(LEGACY_POINTS, 3)
+        return _finite(Track(name, float(values[0]), float(values[1]), points[:,0], points[:,1], points[:,2]))
+    raise ValueError(reason)
+
+
+def _finite(track):
+    "Returns the track, raises ValueError if its ra, dec or any point value is NaN or infinite"
+    if not (np.isfinite(track.ra) and np.isfinite(track.dec) and np.isfinite(track.times).all()
+            and np.isfinite(track.alts).all() and np.isfinite(track.azs).all()):
+        raise ValueError("Track payload has values which are not finite")
+    return track
+
+
+def encode(name, ra, dec, times, alts, azs, float32=False):
+    """Returns a versioned payload, as would be sent by the server. The name is truncated to 255 bytes,
+       if float32 is True, point values are sent as float32, halving the size of the payload"""
+    name = name.encode("utf-8")[:255]
+    times = np.asarray(times, dtype=float)
+    t0 = float(times[0]) if len(times) else 0.0
+    flags = FLOAT32 if float32 else 0
+    points = np.column_stack((times - t0, alts, azs)).astype(_DTYPES[flags])
+    header = _HEADER.pack(MAGIC, VERSION, flags, len(points), len(name), ra, dec, t0)
+    return header + name + points.tobytes()
+
+
+def encode_legacy(name, ra, dec, times, alts, azs):
+    "Returns a legacy payload of twenty points, the name is truncated to 10 bytes"
+    values = []
+    for tstmp, altdeg, azdeg in zip(times, alts, azs):
+        values.extend((float(tstmp), float(altdeg), float(azdeg)))
+    if len(values) != LEGACY_POINTS*3:
+        raise ValueError("A legacy payload has %s points" % (LEGACY_POINTS,))
+    return pack(LEGACY_FORMAT, name.encode("utf-8")[:10], ra, dec, *values)
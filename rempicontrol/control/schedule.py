@@ -31,35 +31,6 @@ def event1(rconn, state, Telescope):
     logging.info("Temperature %s" % (temperature,))
 
 
-# If the rconn motor*status flags are left in a funny state - not 'STOPPED'
-# then the motors can never be started, so check every five minutes, and if the
-# motors have not been called for a period, assume the rconn entry should be STOPPED
-
-
-def event2(rconn, state, Telescope):
-    "event2 checks if motor1 running"
-    now = time.time()
-    motor1 = Telescope.motor1
-    if now > motor1.running + 180:
-        # M1 has not been called for two minutes
-        # ensure its status is stopped
-        rconn.set('motor1status', 'STOPPED')
-        # and reset the timer
-        motor1.running = time.time()
-
-
-def event3(rconn, state, Telescope):
-    "event3 checks if motor2 running"
-    now = time.time()
-    motor2 = Telescope.motor2
-    if now > motor2.running + 180:
-        # M2 has not been called for two minutes
-        # ensure its status is stopped
-        rconn.set('motor2status', 'STOPPED')
-        # and reset the timer
-        motor2.running = time.time()
-
-
 def event4(rconn, state, Telescope):
     "event4 logs current telescope position every two minutes"
     alt = rconn.get('rempi01_current_alt')
@@ -78,10 +49,6 @@ class ScheduledEvents(object):
         event_list = []
         for mins in range(1, 61, 5):              # event1 occurring every five minutes (on minutes 1,6,11,16....56)
             event_list.append((event1,mins))
-        for mins in range(2, 62, 5):              # event2 occurring every five minutes (on minutes 2,7,12,17....57)
-            event_list.append((event2,mins))
-        for mins in range(3, 63, 5):               # event3 occurring every five minutes (on minutes 3,8,13,18....58)
-            event_list.append((event3,mins))
         for mins in range(1, 61, 2):               # event4 occurring every two minutes (on minutes 1,3,5,7....59)
             event_list.append((event4,mins))
         # add further events in format event_list.append((event2,mins)) etc.,
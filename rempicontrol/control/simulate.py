@@ -0,0 +1,301 @@
+################################################################
+#
+# This module runs the Telescope control loop in simulation,
+# on a virtual clock with an in-memory stand in for redis, so
+# hours of operation can be run in seconds
+#
+################################################################
+
+import time
+
+from struct import pack
+
+import numpy as np
+
+from . import telescope, payload
+
+from .tracklog import TIME, TARGET_ALT, TARGET_AZ, ALT, AZ, SPEED_ALT, SPEED_AZ, ERROR_ALT, ERROR_AZ
+
+
+LATITUDE = 53.7     # degrees, the Astronomy Centre near Todmorden
+
+SIDEREAL_RATE = 360.0/86164.0905   # degrees of hour angle per second
+
+
+class SimClock(object):
+    """A virtual clock, sleep returns immediately, advancing the clock by the time slept.
+       walltime is the monotonic time plus an offset, which may be changed with step,
+       as ntp would step the wall clock"""
+
+    def __init__(self, walltime=1.6e9):
+        self.now = 0.0
+        self.offset = walltime
+
+    def monotonic(self):
+        return self.now
+
+    def walltime(self):
+        return self.now + self.offset
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def advance(self, seconds):
+        "Advances the clock without sleeping, as if work had taken this time"
+        self.now += seconds
+
+    def step(self, seconds):
+        "Steps the wall clock"
+        self.offset += seconds
+
+
+def _tobytes(value):
+    "Returns value as redis would store it"
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return repr(value).encode("utf-8")
+
+
+class MemoryRedis(object):
+    """An in-memory stand in for the redis connection, implementing the commands used by
+       the control code. Published messages are recorded in self.published as (channel, message)
+       walltime is the clock giving stream entry ids, normally time.time"""
+
+    def __init__(self, walltime=time.time):
+        self.data = {}
+        self.published = []
+        self.walltime = walltime
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        return [ self.data.get(key) for key in keys + list(args) ]
+
+    def set(self, key, value):
+        self.data[key] = _tobytes(value)
+        return True
+
+    def mset(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        values = self.data.setdefault(name, {})
+        if key is not None:
+            values[_tobytes(key)] = _tobytes(value)
+        if mapping:
+            for field, fieldvalue in mapping.items():
+                values[_tobytes(field)] = _tobytes(fieldvalue)
+        return True
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def xadd(self, name, fields, id='*', maxlen=None, approximate=True):
+        "Adds an entry to a stream, held as a list of (id, fields), returns the id"
+        entries = self.data.setdefault(name, [])
+        milliseconds = int(self.walltime()*1000)
+        sequence = 0
+        if entries:
+            last_milliseconds, last_sequence = entries[-1][0]
+            if milliseconds <= last_milliseconds:
+                milliseconds = last_milliseconds
+                sequence = last_sequence + 1
+        entries.append(((milliseconds, sequence), { _tobytes(field):_tobytes(value) for field, value in fields.items() }))
+        if (maxlen is not None) and (len(entries) > maxlen):
+            del entries[:len(entries) - maxlen]
+        return b"%d-%d" % (milliseconds, sequence)
+
+
+    def xrange(self, name, min='-', max='+', count=None):
+        "Returns a list of (id, fields) of the stream entries with ids from min to max"
+        def streamid(value, default):
+            if value in ('-', '+', b'-', b'+'):
+                return default
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            milliseconds, dash, sequence = str(value).partition('-')
+            return (int(milliseconds), int(sequence) if sequence else default[1])
+        low = streamid(min, (-1, 0))
+        high = streamid(max, (float('inf'), float('inf')))
+        result = [ (b"%d-%d" % entryid, fields) for entryid, fields in self.data.get(name, []) if low <= entryid <= high ]
+        return result if count is None else result[:count]
+
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 0
+
+    def pipeline(self, transaction=True):
+        return _MemoryPipeline(self)
+
+
+class _MemoryPipeline(object):
+    "Queues commands, which are run on execute, returning a list of their results"
+
+    def __init__(self, rconn):
+        self.rconn = rconn
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.rconn, name)
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands = self.commands
+        self.commands = []
+        return [ command(*args, **kwargs) for command, args, kwargs in commands ]
+
+
+def star_altaz(timestamps, dec, ha0, t0):
+    """Returns arrays alt, az in degrees of a star with declination dec, at hour angle ha0 at
+       timestamp t0, seen from LATITUDE, for the given timestamps"""
+    ha = np.radians(ha0 + SIDEREAL_RATE*(np.asarray(timestamps) - t0))
+    dec = np.radians(dec)
+    lat = np.radians(LATITUDE)
+    sinalt = np.sin(dec)*np.sin(lat) + np.cos(dec)*np.cos(lat)*np.cos(ha)
+    alt = np.arcsin(sinalt)
+    cosaz = (np.sin(dec) - sinalt*np.sin(lat))/(np.cos(alt)*np.cos(lat))
+    az = np.degrees(np.arccos(np.clip(cosaz, -1.0, 1.0)))
+    # the star is west of the meridian when the hour angle is positive
+    az = np.where(np.sin(ha) > 0, 360.0 - az, az)
+    return np.degrees(alt), az
+
+
+def star_payload(name, dec, ha0, t0, start, points=20, interval=30.0):
+    """Returns a payload, as the server would send, for the star of star_altaz with points every
+       interval seconds from timestamp start, a legacy payload for twenty points, otherwise versioned"""
+    timestamps = start + interval*np.arange(points)
+    alt, az = star_altaz(timestamps, dec, ha0, t0)
+    if points == payload.LEGACY_POINTS:
+        return payload.encode_legacy(name, 0.0, dec, timestamps, alt, az)
+    return payload.encode(name, 0.0, dec, timestamps, alt, az)
+
+
+class SimTelescope(telescope.Telescope):
+    """A Telescope which writes its telemetry and fits its payloads without background threads, so results are
+       repeatable, and drives simulated motor outputs"""
+
+    TELEMETRY_BACKGROUND = False
+
+    FIT_BACKGROUND = False
+
+    SIMULATE_MOTORS = True
+
+
+class Simulation(object):
+    """Runs the Telescope control loop on a SimClock, recording each tick.
+
+       scope = Simulation()
+       scope.goto(dec=20.0, ha0=-60.0)       # or scope.altaz(45.0, 180.0)
+       scope.run(3600)                        # seconds
+       print(scope.summary())
+
+       record is a numpy array with a row per tick, of the columns of the tracking log, TIME, TARGET_ALT,
+       TARGET_AZ, ALT, AZ, SPEED_ALT, SPEED_AZ, ERROR_ALT, ERROR_AZ, where target is the target position
+       at the tick time"""
+
+    # the server sends new track data every four minutes
+    TRACK_INTERVAL = 240.0
+
+    def __init__(self, walltime=1.6e9, alt=0.0, az=0.0, work=0.0, telescope_class=SimTelescope):
+        """alt, az is the starting position of the scope, work is the time in seconds each tick
+           takes to do its work, which is added to the clock"""
+        self.clock = SimClock(walltime)
+        self.rconn = MemoryRedis(self.clock.walltime)
+        self.work = work
+        self.scope = telescope_class(self.rconn, {}, clock=self.clock)
+        self.scope.alt = alt
+        self.scope.az = az
+        self.star = None
+        self.next_track = None
+        self.started = False
+        self.record = np.empty((0, 9))
+
+
+    def goto(self, dec, ha0, name="Target"):
+        "Sends a goto for the star with declination dec at hour angle ha0 now, which is then tracked"
+        t0 = self.clock.walltime()
+        self.star = (name, dec, ha0, t0)
+        self.scope.goto({'data': star_payload(name, dec, ha0, t0, t0)})
+        self.next_track = self.clock.monotonic() + self.TRACK_INTERVAL
+
+
+    def altaz(self, alt, az):
+        "Sends an altaz, to move to alt, az and stop"
+        self.star = None
+        self.next_track = None
+        self.scope.altaz({'data': pack("dd", alt, az)})
+
+
+    def run(self, seconds):
+        "Runs the control loop for the given seconds of virtual time, appending each tick to self.record"
+        scope = self.scope
+        if not self.started:
+            scope.start()
+            self.started = True
+        ticks = int(round(seconds/scope.interval))
+        record = np.empty((ticks, 9))
+        for row in range(ticks):
+            if (self.next_track is not None) and (self.clock.monotonic() >= self.next_track):
+                # the server sends tracking data, starting from now, in the rempi01_track key
+                # with a message on the track channel, delivered here without a pubsub thread
+                name, dec, ha0, t0 = self.star
+                self.rconn.set('rempi01_track', star_payload(name, dec, ha0, t0, self.clock.walltime()))
+                self.scope.track({'channel': b'track', 'data': b'NEW'})
+                self.next_track += self.TRACK_INTERVAL
+            self.clock.advance(self.work)
+            scope.tick()
+            record[row, TIME] = scope.ticker.timestamp()
+            record[row, TARGET_ALT] = scope.old_target_alt
+            record[row, TARGET_AZ] = scope.old_target_az
+            record[row, ALT] = scope.current_alt
+            record[row, AZ] = scope.current_az
+            record[row, SPEED_ALT] = scope.speed_alt
+            record[row, SPEED_AZ] = scope.speed_az
+        record[:, ERROR_ALT] = record[:, TARGET_ALT] - record[:, ALT]
+        record[:, ERROR_AZ] = (record[:, TARGET_AZ] - record[:, AZ] + 180.0) % 360.0 - 180.0
+        self.record = np.vstack((self.record, record))
+        return record
+
+
+    def limit_hits(self, record=None):
+        """Returns a dictionary of the number of ticks at the speed and acceleration limits, for
+           both axes together, and of ticks exceeding them"""
+        if record is None:
+            record = self.record
+        scope = self.scope
+        speeds = np.abs(record[:, SPEED_ALT:SPEED_AZ+1])
+        accelerations = np.abs(np.diff(record[:, SPEED_ALT:SPEED_AZ+1], axis=0))/scope.interval
+        return { 'speed_at_limit': int(np.sum(speeds >= 0.999*scope.MAX_SPEED)),
+                 'speed_over_limit': int(np.sum(speeds > scope.MAX_SPEED*(1 + 1e-9))),
+                 'acceleration_at_limit': int(np.sum(accelerations >= 0.8*scope.MAX_ACCELERATION)),
+                 'acceleration_over_limit': int(np.sum(accelerations > scope.MAX_ACCELERATION*(1 + 1e-9))) }
+
+
+    def summary(self, settle=0.0, record=None):
+        """Returns a dictionary summarising the record, tracking errors are taken from settle
+           seconds after the start of the record, to exclude the initial slew"""
+        if record is None:
+            record = self.record
+        result = { 'ticks': len(record),
+                   'seconds': len(record)*self.scope.interval }
+        result.update(self.limit_hits(record))
+        tracked = record[record[:, TIME] >= record[0, TIME] + settle] if len(record) else record
+        if len(tracked):
+            for name, column in (('alt', ERROR_ALT), ('az', ERROR_AZ)):
+                result['error_%s_rms' % name] = float(np.sqrt(np.mean(tracked[:, column]**2)))
+                result['error_%s_max' % name] = float(np.abs(tracked[:, column]).max())
+        return result
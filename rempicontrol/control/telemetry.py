@@ -0,0 +1,189 @@
+################################################################
+#
+# This module defines a TelemetryWriter, which sends the values
+# produced by the telescope control loop to redis
+#
+################################################################
+
+import threading, logging
+
+from time import perf_counter
+
+# The control loop sets several redis keys every tick, as separate SET calls each of these
+# is a blocking round trip to redis. The TelemetryWriter instead collects the values of a
+# tick, and sends them in a single pipelined round trip when flushed.
+
+# If background is True, the round trip is made by a writer thread, so a slow redis cannot
+# lengthen the control loop tick. If the writer falls behind, values not yet sent are
+# replaced by the newer values for the same keys, so only the latest are written. Stream
+# entries and published messages are not replaced, as each is a record or notification of
+# its tick, so all are sent, in the order given.
+
+
+class TelemetryWriter(object):
+
+    def __init__(self, rconn, background=False):
+        "rconn is the redis connection, if background is True writes are made by a thread"
+        self.rconn = rconn
+        self.background = background
+        # values set since the last flush, key:value for strings, name:{field:value} for hashes,
+        # a set of keys to delete, and a list of stream entries to add and messages to publish,
+        # each as (command, args, kwargs) of the redis pipeline call.
+        # These may be set by other threads, so are guarded by a lock
+        self._values = {}
+        self._hashes = {}
+        self._deletes = set()
+        self._entries = []
+        self._pending = threading.Lock()
+        # counts of round trips, of unsent values replaced by newer ones, and of failed writes
+        self.writes = 0
+        self.replaced = 0
+        self.errors = 0
+        # statistics of the time spent by the caller in flush, and of redis round trips, in seconds
+        self.reset_stats()
+        if background:
+            # values flushed but not yet sent by the writer thread
+            self._unsent_values = {}
+            self._unsent_hashes = {}
+            self._unsent_deletes = set()
+            self._unsent_entries = []
+            self._lock = threading.Lock()
+            self._ready = threading.Event()
+            self._writer = threading.Thread(target=self._run, name='telemetry', daemon=True)
+            self._writer.start()
+
+
+    def reset_stats(self):
+        "Resets the flush and round trip time statistics"
+        self.flush_count = 0
+        self.flush_sum = 0.0
+        self.flush_max = 0.0
+        self.redis_count = 0
+        self.redis_sum = 0.0
+        self.redis_max = 0.0
+
+
+    def set(self, key, value):
+        "Sets a string value to be written on the next flush"
+        with self._pending:
+            self._deletes.discard(key)
+            self._values[key] = value
+
+
+    def hset(self, name, mapping):
+        "Sets the fields of the hash name, to be written on the next flush"
+        with self._pending:
+            self._hashes.setdefault(name, {}).update(mapping)
+
+
+    def xadd(self, name, fields, maxlen):
+        """Sets an entry of fields, field:value, to be added to the stream name on the next flush,
+           the stream is trimmed to approximately maxlen entries"""
+        with self._pending:
+            self._entries.append(('xadd', (name, fields), {'maxlen':maxlen, 'approximate':True}))
+
+
+    def publish(self, channel, message):
+        "Sets a message to be published on channel on the next flush, after the values are written"
+        with self._pending:
+            self._entries.append(('publish', (channel, message), {}))
+
+
+    def delete(self, key):
+        "Sets a key to be deleted on the next flush"
+        with self._pending:
+            self._values.pop(key, None)
+            self._deletes.add(key)
+
+
+    def flush(self):
+        "Sends the values set since the last flush"
+        if not (self._values or self._hashes or self._deletes or self._entries):
+            return
+        start = perf_counter()
+        with self._pending:
+            values = self._values
+            hashes = self._hashes
+            deletes = self._deletes
+            entries = self._entries
+            self._values = {}
+            self._hashes = {}
+            self._deletes = set()
+            self._entries = []
+        if self.background:
+            with self._lock:
+                if self._unsent_values or self._unsent_hashes or self._unsent_deletes or self._unsent_entries:
+                    # the writer has not yet sent the previous values, these are overwritten
+                    self.replaced += 1
+                for key in deletes:
+                    self._unsent_values.pop(key, None)
+                self._unsent_deletes.difference_update(values)
+                self._unsent_deletes.update(deletes)
+                self._unsent_values.update(values)
+                for name, mapping in hashes.items():
+                    self._unsent_hashes.setdefault(name, {}).update(mapping)
+                self._unsent_entries.extend(entries)
+            self._ready.set()
+        else:
+            self._write(values, hashes, deletes, entries)
+        elapsed = perf_counter() - start
+        self.flush_count += 1
+        self.flush_sum += elapsed
+        if elapsed > self.flush_max:
+            self.flush_max = elapsed
+
+
+    def _write(self, values, hashes, deletes, entries):
+        """Writes values, hashes and stream entries, deletes keys and publishes messages, in one round trip
+           to redis, and records the time taken"""
+        start = perf_counter()
+        try:
+            pipe = self.rconn.pipeline(transaction=False)
+            if deletes:
+                pipe.delete(*deletes)
+            if values:
+                pipe.mset(values)
+            for name, mapping in hashes.items():
+                pipe.hset(name, mapping=mapping)
+            for command, args, kwargs in entries:
+                getattr(pipe, command)(*args, **kwargs)
+            pipe.execute()
+        except Exception:
+            self.errors += 1
+            logging.error('Failed to write telemetry to redis')
+            return
+        elapsed = perf_counter() - start
+        self.writes += 1
+        self.redis_count += 1
+        self.redis_sum += elapsed
+        if elapsed > self.redis_max:
+            self.redis_max = elapsed
+
+
+    def _run(self):
+        "The writer thread, sends values as they are flushed"
+        while True:
+            self._ready.wait()
+            with self._lock:
+                self._ready.clear()
+                values = self._unsent_values
+                hashes = self._unsent_hashes
+                deletes = self._unsent_deletes
+                entries = self._unsent_entries
+                self._unsent_values = {}
+                self._unsent_hashes = {}
+                self._unsent_deletes = set()
+                self._unsent_entries = []
+            self._write(values, hashes, deletes, entries)
+
+
+    def stats(self):
+        """Returns a dictionary of write counts, and times in milliseconds since the last reset_stats
+           tick_redis is the time spent in flush by the control loop, redis the round trip time"""
+        return { 'redis_writes': self.writes,
+                 'redis_replaced': self.replaced,
+                 'redis_errors': self.errors,
+                 'tick_redis_mean_ms': round(self.flush_sum/self.flush_count*1000, 3) if self.flush_count else 0.0,
+                 'tick_redis_max_ms': round(self.flush_max*1000, 3),
+                 'redis_mean_ms': round(self.redis_sum/self.redis_count*1000, 3) if self.redis_count else 0.0,
+                 'redis_max_ms': round(self.redis_max*1000, 3) }
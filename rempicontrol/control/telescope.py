@@ -6,17 +6,17 @@
 #
 ################################################################
 
-import logging
+import logging, math, threading, functools
 
 from struct import pack, unpack
 
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 
-from time import sleep
+from bisect import bisect_right
 
-from scipy.optimize import curve_fit
+import numpy as np
 
-from . import motors
+from . import motors, ticker, telemetry, payload, tracklog, fitworker
 
 # telescope has states:
 
@@ -26,6 +26,11 @@ from . import motors
 
 # stopped - at a given alt az
 
+# these are sent with each position notification on channel 'position', read by rempicomms.positions
+SLEWING = 'slewing'
+TRACKING = 'tracking'
+STOPPED = 'stopped'
+
 
 # function _qcurve and its parameters are used to 'fit' between a set of alt az points provided
 # by the main web server, this is then used to interpolate at times between the points
@@ -35,6 +40,319 @@ def _qcurve(x, a, b, c):
     return a*x*x + b*x + c
 
 
+# The fit is a linear least squares problem. With x measured in seconds from the start of
+# each curve (rather than as a unix timestamp, whose square loses precision) the design
+# matrix only depends on the sample offsets, so its pseudo-inverse can be computed once
+# and reused, the coefficients are then a single matrix product.
+
+# Payloads with irregular timestamps give new offsets with each goto, so the cache is bounded,
+# holding the most recently used, which include the server's fixed grid
+
+def _pinv(offsets):
+    "Returns the pseudo-inverse of the quadratic design matrix for the given time offsets, cached against the offsets"
+    return _pinv_rounded(tuple(round(float(x), 3) for x in offsets))
+
+@functools.lru_cache(maxsize=64)
+def _pinv_rounded(key):
+    "Returns the pseudo-inverse for a tuple of offsets rounded to milliseconds"
+    x = np.array(key)
+    return np.linalg.pinv(np.column_stack((x*x, x, np.ones_like(x))))
+
+# precompute for the server's fixed grid of points at 30 second intervals, curves of six and seven points
+_pinv(30.0*np.arange(6))
+_pinv(30.0*np.arange(7))
+
+
+# get_speed limits acceleration by bringing the distance moved in an interval closer to the
+# previous distance, each step multiplies their difference by _BLEND
+_BLEND = 5.0/6.0
+_LOG_BLEND = math.log(_BLEND)
+
+
+def unwrap_az(azseries):
+    """Returns a numpy array of azimuths with the 360->0 discontinuity removed, so that
+       consecutive values never differ by more than 180 degrees. For example
+       350, 355, 1, 6 becomes 350, 355, 361, 366"""
+    az = np.array(azseries, dtype=float)
+    if len(az) > 1:
+        az[1:] -= 360.0*np.cumsum(np.round(np.diff(az)/360.0))
+    return az
+
+
+def segment_track(points):
+    """Returns a list of (start, stop) index slices dividing a track of the given number of points
+       into overlapping segments, each to be fitted with its own curve.
+       Segments are of six or seven points, each overlapping the previous by two points, except
+       that tracks of fewer than ten points are fitted with a single curve, and tracks of ten to
+       thirteen points with two curves, of up to eight points"""
+    if points < 3:
+        raise ValueError("At least three points are required to create curves")
+    count = max(1, (points - 2)//4)
+    # each segment starts two points before the end of the previous one, so the starts are spread
+    # evenly over the points less the last two, and segment n runs from start n to start n+1 plus two
+    starts = [ round(n*(points - 2)/count) for n in range(count + 1) ]
+    return [ (starts[n], starts[n+1] + 2) for n in range(count) ]
+
+
+def fit_segments(times, alts, azs, segments):
+    """Fits quadratic curves to alt and az, for each segment in one least squares step per segment length
+       times, alts, azs are sequences of equal length, sorted by time
+       segments is a list of (start, stop) index slices into these sequences
+       Returns a numpy array of the coefficients with shape (segments, 2, 3), for each segment the
+       a, b, c of alt and of az, for x measured in seconds from the timestamp of the segment start"""
+    times = np.asarray(times, dtype=float)
+    # alt and az as columns, az unwrapped across the whole track so every segment is continuous
+    values = np.column_stack((np.asarray(alts, dtype=float), unwrap_az(azs)))
+    # group the segments by their time offsets, so each group shares a pseudo-inverse
+    groups = {}
+    for index, (start, stop) in enumerate(segments):
+        offsets = times[start:stop] - times[start]
+        key = tuple(np.round(offsets, 3))
+        groups.setdefault(key, []).append(index)
+    result = np.empty((len(segments), 2, 3))
+    for key, indices in groups.items():
+        # stack the alt and az columns of every segment in this group side by side, shape (points, 2*segments)
+        columns = np.hstack([values[segments[index][0]:segments[index][1]] for index in indices])
+        # coefficients have shape (3, 2*segments), a row each for a, b, c
+        coeffs = _pinv(key) @ columns
+        result[indices] = coeffs.T.reshape(len(indices), 2, 3)
+    return result
+
+
+# An interpolator is built once from the alt, az points of each goto or track payload, and is
+# then evaluated to give the target position, and its rate, at any time. Interpolators are
+# subclasses of Interpolator, and the one used is set by Telescope.INTERPOLATOR
+
+class Interpolator(object):
+    """Base class of the interpolators. A subclass __init__ should call this __init__, then
+       build whatever it needs from self.times and self.values, and define evaluate"""
+
+    def __init__(self, times, alts, azs):
+        """times, alts, azs are sequences of the timestamps and alt,az positions of each point
+           sets self.times, a sorted numpy array, self.values, with shape (points, 2), columns of
+           alt and az with az unwrapped, and self.start, self.end, the times of the first and last points"""
+        order = np.argsort(times)
+        self.times = np.asarray(times, dtype=float)[order]
+        self.values = np.column_stack((np.asarray(alts, dtype=float)[order], unwrap_az(np.asarray(azs, dtype=float)[order])))
+        self.start = float(self.times[0])
+        self.end = float(self.times[-1])
+
+
+    def _interval(self, timestamps):
+        """Returns the index of the interval between points in which each timestamp lies, timestamps
+           outside the points take the first or last interval"""
+        return np.clip(np.searchsorted(self.times, timestamps, side='right') - 1, 0, len(self.times) - 2)
+
+
+    def evaluate(self, timestamps):
+        """Returns arrays alt, az, alt_rate, az_rate at the numpy array of timestamps, with az unwrapped,
+           rates in degrees per second"""
+        raise NotImplementedError
+
+
+    def at(self, timestamp):
+        "Returns alt, az at timestamp, with az unwrapped"
+        alt, az = self.evaluate(np.array([timestamp]))[:2]
+        return alt.item(), az.item()
+
+
+class QuadraticInterpolator(Interpolator):
+    """Quadratic curves fitted to overlapping segments of the points, each curve
+       applies from the timestamp at the start of its segment, until the start of the next.
+
+       starts is a sorted list of the curve start timestamps, and coeffs a numpy array of shape
+       (curves, 2, 3) with the a, b, c of alt and az for each curve, as functions of seconds
+       since the curve start."""
+
+    def __init__(self, times, alts, azs):
+        Interpolator.__init__(self, times, alts, azs)
+        segments = segment_track(len(self.times))
+        self.coeffs = fit_segments(self.times, self.values[:,0], self.values[:,1], segments)
+        self.starts = [ float(self.times[start]) for start, stop in segments ]
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def index(self, timestamp):
+        "Returns the index of the curve in use at timestamp, timestamps before the first curve use the first"
+        return max(bisect_right(self.starts, timestamp) - 1, 0)
+
+
+    def at(self, timestamp):
+        "Returns alt, az from the curves at timestamp, with az unwrapped"
+        index = self.index(timestamp)
+        seconds = timestamp - self.starts[index]
+        popt_alt, popt_az = self.coeffs[index]
+        return _qcurve(seconds, *popt_alt), _qcurve(seconds, *popt_az)
+
+
+    def evaluate(self, timestamps):
+        index = np.maximum(np.searchsorted(self.starts, timestamps, side='right') - 1, 0)
+        seconds = timestamps - np.asarray(self.starts)[index]
+        a, b, c = np.moveaxis(self.coeffs[index], 2, 0)
+        # a, b, c have shape (timestamps, 2), columns for alt and az
+        seconds = seconds[:,np.newaxis]
+        positions = (a*seconds + b)*seconds + c
+        # the rates are the derivatives of the quadratics
+        rates = 2*a*seconds + b
+        return positions[:,0], positions[:,1], rates[:,0], rates[:,1]
+
+
+class HermiteInterpolator(Interpolator):
+    """Piecewise cubic Hermite interpolation, passing through every point, with the slope at each
+       point taken from the parabola through it and its neighbours, so both position and rate are
+       continuous"""
+
+    def __init__(self, times, alts, azs):
+        Interpolator.__init__(self, times, alts, azs)
+        if len(self.times) < 3:
+            raise ValueError("At least three points are required to create curves")
+        h = np.diff(self.times)[:,np.newaxis]
+        secants = np.diff(self.values, axis=0)/h
+        slopes = np.empty_like(self.values)
+        # interior points, the derivative of the parabola through the point and its neighbours
+        slopes[1:-1] = (h[1:]*secants[:-1] + h[:-1]*secants[1:])/(h[:-1] + h[1:])
+        # end points, the derivative at the ends of the parabolas through the first and last three points
+        slopes[0] = ((2*h[0] + h[1])*secants[0] - h[0]*secants[1])/(h[0] + h[1])
+        slopes[-1] = ((2*h[-1] + h[-2])*secants[-1] - h[-1]*secants[-2])/(h[-1] + h[-2])
+        self.slopes = slopes
+
+
+    def evaluate(self, timestamps):
+        index = self._interval(timestamps)
+        h = (self.times[index+1] - self.times[index])[:,np.newaxis]
+        s = ((timestamps - self.times[index])[:,np.newaxis])/h
+        y0 = self.values[index]
+        y1 = self.values[index+1]
+        m0 = self.slopes[index]*h
+        m1 = self.slopes[index+1]*h
+        s2 = s*s
+        s3 = s2*s
+        positions = (2*s3 - 3*s2 + 1)*y0 + (s3 - 2*s2 + s)*m0 + (-2*s3 + 3*s2)*y1 + (s3 - s2)*m1
+        rates = ((6*s2 - 6*s)*y0 + (3*s2 - 4*s + 1)*m0 + (-6*s2 + 6*s)*y1 + (3*s2 - 2*s)*m1)/h
+        return positions[:,0], positions[:,1], rates[:,0], rates[:,1]
+
+
+class SplineInterpolator(Interpolator):
+    """Natural cubic spline, passing through every point with continuous position, rate and
+       acceleration, and zero acceleration at the first and last points"""
+
+    def __init__(self, times, alts, azs):
+        Interpolator.__init__(self, times, alts, azs)
+        points = len(self.times)
+        if points < 3:
+            raise ValueError("At least three points are required to create curves")
+        h = np.diff(self.times)[:,np.newaxis]
+        secants = np.diff(self.values, axis=0)/h
+        # solve the tridiagonal system for the second derivatives at the interior points,
+        # h[i-1]*M[i-1] + 2*(h[i-1]+h[i])*M[i] + h[i]*M[i+1] = 6*(secants[i] - secants[i-1])
+        # by forward elimination and back substitution, alt and az together
+        diagonal = 2*(h[:-1] + h[1:])
+        rhs = 6*(secants[1:] - secants[:-1])
+        for i in range(1, points - 2):
+            factor = h[i]/diagonal[i-1]
+            diagonal[i] = diagonal[i] - factor*h[i]
+            rhs[i] = rhs[i] - factor*rhs[i-1]
+        second = np.zeros_like(self.values)
+        second[points-2] = rhs[-1]/diagonal[-1]
+        for i in range(points - 3, 0, -1):
+            second[i] = (rhs[i-1] - h[i]*second[i+1])/diagonal[i-1]
+        self.second = second
+
+
+    def evaluate(self, timestamps):
+        index = self._interval(timestamps)
+        h = (self.times[index+1] - self.times[index])[:,np.newaxis]
+        b = ((timestamps - self.times[index])[:,np.newaxis])/h
+        a = 1.0 - b
+        y0 = self.values[index]
+        y1 = self.values[index+1]
+        m0 = self.second[index]
+        m1 = self.second[index+1]
+        positions = a*y0 + b*y1 + ((a*a*a - a)*m0 + (b*b*b - b)*m1)*h*h/6.0
+        rates = (y1 - y0)/h + ((1.0 - 3*a*a)*m0 + (3*b*b - 1.0)*m1)*h/6.0
+        return positions[:,0], positions[:,1], rates[:,0], rates[:,1]
+
+
+
+class _WriteThrough(object):
+    """A Telescope attribute whose value is held in memory, and written through to a redis key by
+       the Telescope telemetry writer. As the telescope is the only writer of these keys, they are
+       not read back from redis, unless Telescope.target_changed is called. Values are strings,
+       other values are converted as redis would store them"""
+
+    def __init__(self, key, doc):
+        self.key = key
+        self.__doc__ = doc
+
+    def __get__(self, telescope, owner=None):
+        if telescope is None:
+            return self
+        return telescope._cached.get(self.key, '')
+
+    def __set__(self, telescope, value):
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        elif not isinstance(value, str):
+            value = repr(value)
+        telescope._cached[self.key] = value
+        telescope.telemetry.set(self.key, value)
+
+    def __delete__(self, telescope):
+        telescope._cached[self.key] = ''
+        telescope.telemetry.delete(self.key)
+
+
+class Trajectory(object):
+    """A table of the target position at each control tick over the time covered by a set of curves,
+       so the control loop only needs to look up a row rather than select and evaluate a curve.
+       Each row of table is timestamp, alt, az, alt_rate, az_rate, with az unwrapped, rates in degrees
+       per second"""
+
+    def __init__(self, curves, interval, track=None, received=None):
+        """curves is an Interpolator, interval is the control tick in seconds, track is the payload.Track
+           the curves were built from, and received the monotonic time its payload was received.
+           A Trajectory is not changed once built, so may be passed between threads"""
+        self.curves = curves
+        self.track = track
+        self.received = received
+        self.interval = interval
+        self.start = curves.start
+        self.end = curves.end
+        timestamps = np.arange(self.start, self.end + interval, interval)
+        # the last row is at, or just past end
+        self.rows = len(timestamps)
+        self.table = np.empty((self.rows, 5))
+        self.table[:,0] = timestamps
+        for column, values in enumerate(curves.evaluate(timestamps), start=1):
+            self.table[:,column] = values
+        np.clip(self.table[:,1], -90.0, 90.0, out=self.table[:,1])
+        self.table.flags.writeable = False
+
+
+    def at(self, timestamp):
+        """Returns alt, az, alt_rate, az_rate at the given timestamp, linearly
+           interpolated between rows, timestamps outside the table take the first or last row"""
+        position = (timestamp - self.start)/self.interval
+        if position <= 0.0:
+            index = 0
+            fraction = 0.0
+        elif position >= self.rows - 1:
+            index = self.rows - 2
+            fraction = 1.0
+        else:
+            index = int(position)
+            fraction = position - index
+        item = self.table.item
+        alt = item(index, 1) + (item(index+1, 1) - item(index, 1))*fraction
+        az = item(index, 2) + (item(index+1, 2) - item(index, 2))*fraction
+        alt_rate = item(index, 3) + (item(index+1, 3) - item(index, 3))*fraction
+        az_rate = item(index, 4) + (item(index+1, 4) - item(index, 4))*fraction
+        return alt, az % 360.0, alt_rate, az_rate
+
+
 
 class Telescope(object):
 
@@ -42,317 +360,293 @@ class Telescope(object):
 
     MAX_ACCELERATION = 1.5 # degrees per second squared
 
-    TIME_INTERVAL = 0.5 # seconds
+    TIME_INTERVAL = 0.5 # seconds, the initial control loop interval, which may be changed by set_interval
+
+    MIN_INTERVAL = 0.05 # seconds, the shortest interval which may be set
+
+    LOAD_LIMIT = 0.5 # an interval may only be set if the measured 99th percentile tick duration is within this fraction of it
+
+    SELFTEST_INTERVALS = (0.5, 0.2, 0.1, 0.05) # seconds, intervals run by selftest
+
+    INTERPOLATOR = QuadraticInterpolator # creates curves through the goto and track positions
 
     DECELERATION_DISTANCE = 10.0 # degrees
 
+    TICK_POLICY = ticker.SKIP  # on overrunning a tick, skip missed ticks rather than run them late
+
+    TICK_STATS_INTERVAL = 60 # seconds between publishing control loop jitter statistics to redis
+
+    TELEMETRY_INTERVAL = 0.5 # seconds between publishing positions to redis, however short the control loop interval
+
+    TELEMETRY_BACKGROUND = True # write telemetry to redis from a separate thread, so redis delays do not hold up the loop
+
+    FIT_BACKGROUND = True # fit goto and track payloads in a separate thread, rather than the pubsub thread
+
+    TRACKING_LOG_TICKS = 7200 # ticks of target, position and error held in the tracking log, an hour at 0.5 second ticks
+
+    TRACKING_SUMMARY_INTERVAL = 10 # seconds between publishing the tracking error summary to redis
+
+    POSITION_HISTORY = 7200 # approximate number of positions held in the redis stream rempi01_position_history, one per TELEMETRY_INTERVAL
+
+    TRACKING_ERROR = 0.05 # degrees, within which of its target on each axis the scope is tracking rather than slewing
 
-    def __init__(self, rconn, state):
-        "The Telescope instrument"
+    SIMULATE_MOTORS = False # drive hardware.SimulatedPWM outputs rather than the gpio, so the loop can run off the Pi
+
+
+    def __init__(self, rconn, state, clock=None):
+        """The Telescope instrument, clock is normally None, for the control loop to use the system clocks,
+           but may be an object with methods monotonic, walltime and sleep, such as a simulate.SimClock"""
         self.state = state
         # info stored to redis
         self.rconn = rconn
-        # curves is a dictionary of timestamp:curve
-        self.curves = {}
-        # curvetimes is a sorted list of the curve timestamps
-        self.curvetimes = []
-        self.tracking = False
+        # trajectory is the Trajectory being tracked, or None if not tracking. It is built by the fit
+        # worker from the last goto or track positions received, and replaced whole by a single
+        # assignment, so the control loop always reads a complete trajectory
+        self.trajectory = None
+        # held while replacing the trajectory, so a new trajectory is not lost as the old one expires
+        self._swap = threading.Lock()
+        # incremented by each goto and altaz command, each fit job carries the generation at which it
+        # was submitted, and its trajectory is only installed if no newer command has been received
+        self.generation = 0
+        self.fitter = fitworker.FitWorker(self.fit, self.FIT_BACKGROUND)
+        # the trajectory last used by the control loop, and statistics of the time from its payload
+        # being received to its first use, in seconds
+        self._used_trajectory = None
+        self.reset_latency()
+        # the values produced by the control loop are sent to redis in one round trip per tick
+        self.telemetry = telemetry.TelemetryWriter(rconn, self.TELEMETRY_BACKGROUND)
+        # a ring buffer of the target, position, speed and error of each tick
+        self.tracklog = tracklog.TrackingLog(self.TRACKING_LOG_TICKS)
+        # set by dump_tracking, the log is dumped by the control loop at the end of its next tick
+        self._dump_requested = False
+        # values of _WriteThrough attributes, key:value
+        self._cached = {}
         self.alt = 0.0           # initial conditions, could be changed to a 'parking' state
         self.az = 0.0
         self.target_name = ''
         self.ra = ''
         self.dec = ''
 
-        # the telescope motors
-        self.motor1 = motors.Motor('motor1',rconn)
-        self.motor2 = motors.Motor('motor2',rconn)
+        # the telescope motors, motor1 drives altitude and motor2 azimuth, clockwise increasing
+        self.motor1 = motors.Motor('motor1', rconn, simulate=self.SIMULATE_MOTORS, telemetry=self.telemetry)
+        self.motor2 = motors.Motor('motor2', rconn, simulate=self.SIMULATE_MOTORS, telemetry=self.telemetry)
+
+        # the control loop interval, and an interval set by set_interval, to be applied at the next tick
+        self.interval = self.TIME_INTERVAL
+        self._new_interval = None
 
         # max distance which can be moved in a time interval, which is limited by the maximum speed allowed
-        self.max_delta_distance = self.MAX_SPEED * self.TIME_INTERVAL
+        self.max_delta_distance = self.MAX_SPEED * self.interval
+
+        # the control loop ticks are timed on the monotonic clock, with timestamps taken from the wall clock
+        if clock is None:
+            self.ticker = ticker.Ticker(self.interval, self.TICK_POLICY)
+        else:
+            self.ticker = ticker.Ticker(self.interval, self.TICK_POLICY, clock.monotonic, clock.walltime, clock.sleep)
 
+        # the state of the control loop, set by self.start(), and updated by self.tick()
+        self.current_alt = self.alt     # the position of the scope
+        self.current_az = self.az
+        self.speed_alt = 0.0            # the speed of the scope over the last interval
+        self.speed_az = 0.0
+        self.old_target_alt = self.alt  # the target position for the current time
+        self.old_target_az = self.az
 
-    @property
-    def target_name(self):
-        "Returns target name or empty string if name not set"
-        target_name = self.rconn.get("rempi01_target_name")
-        if target_name is None:
-            return ''
-        return target_name.decode("utf-8")
 
-    @target_name.setter
-    def target_name(self, target_name):
-        self.rconn.set("rempi01_target_name", target_name)
+    # target_name, ra and dec are held in memory, and written through to redis
+    target_name = _WriteThrough("rempi01_target_name", "target name or empty string if name not set")
+    ra = _WriteThrough("rempi01_target_ra", "target ra as a string or empty string if ra not set")
+    dec = _WriteThrough("rempi01_target_dec", "target dec as a string or empty string if dec not set")
 
-    @target_name.deleter
-    def target_name(self):
-        self.rconn.delete("rempi01_target_name")
 
     @property
-    def ra(self):
-        "Returns target ra as a string or empty string if ra not set"
-        target_ra = self.rconn.get("rempi01_target_ra")
-        if target_ra is None:
-            return ''
-        return target_ra.decode("utf-8")
+    def tracking(self):
+        "True if a trajectory is being tracked"
+        return self.trajectory is not None
 
-    @ra.setter
-    def ra(self, target_ra):
-        self.rconn.set("rempi01_target_ra", target_ra)
-
-    @ra.deleter
-    def ra(self):
-        self.rconn.delete("rempi01_target_ra")
 
     @property
-    def dec(self):
-        "Returns target dec as a string or empty string if dec not set"
-        target_dec = self.rconn.get("rempi01_target_dec")
-        if target_dec is None:
-            return ''
-        return target_dec.decode("utf-8")
+    def curves(self):
+        "The INTERPOLATOR instance of the trajectory being tracked, or None"
+        trajectory = self.trajectory
+        return None if trajectory is None else trajectory.curves
+
 
-    @dec.setter
-    def dec(self, target_dec):
-        self.rconn.set("rempi01_target_dec", target_dec)
+    def reset_latency(self):
+        "Resets the statistics of the time from a payload being received to its trajectory being used"
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
 
-    @dec.deleter
-    def dec(self):
-        self.rconn.delete("rempi01_target_dec")
+
+    def target_changed(self, msg):
+        """Handles the pubsub msg sent when another process has changed the target name, ra or dec
+           in redis, reloads them into memory"""
+        keys = [ attribute.key for attribute in (Telescope.target_name, Telescope.ra, Telescope.dec) ]
+        self._cached.update(zip(keys, [ '' if value is None else value.decode("utf-8") for value in self.rconn.mget(keys) ]))
 
 
     def goto(self, msg):
-        "Handles the pubsub msg - receives a target set of alt,az values and creates the curves"
-        # Set tracking False, to stop previous tracking
-        self.tracking = False
-        # positions consists of target_name, ra, dec and 20 sets of timestamp,alt,az which is a string and 62 floats,
-        # these alt and az values are for nineteen 30 second intervals (9.5 minutes), these are updated from the server every 4 minutes
-        positions = unpack("10s"+"d"*62, msg['data'])
-        self.target_name = positions[0].rstrip(b'\x00').decode("utf-8")
-        self.ra = positions[1]
-        self.dec = positions[2]
-        logging.info('Goto received RA %s DEC %s' % (positions[1], positions[2]))
-        # create a dictionary of {timestamp:(alt,az), timestamp:(alt,az),....}
-        # note positions[3:] is used as the first three elements are the name, ra and dec
-        time_altaz = { tstmp : (altdeg, azdeg) for tstmp, altdeg, azdeg in zip(*[iter(positions[3:])]*3) }
-        # create a dictionary of curves for interpolation
-        self.curves = self.createcurves(time_altaz)
-        self.curvetimes = list(self.curves.keys())
-        self.curvetimes.sort()
-        # set the received positions into the redis tracking key
-        self.rconn.set('rempi01_track', msg['data'])
-        # set tracking True to let telescope know to use these curves
-        self.tracking = True
- 
-
-    def createcurves(self, time_altaz):
-        """create four sets of curves, each with a timestamp covering the 20 sets of timestamps
-           time_altaz is a dictionary of timestamps against alt,az positions
-           {timestamp:(alt,az), timestamp:(alt,az),....}
-           """
-        timelist = list(time_altaz.keys())
-        timelist.sort()
-
-        curves = {}
-      
+        "Handles the pubsub msg - receives a target set of alt,az values, which are passed to the fit worker"
+        with self._swap:
+            self.generation += 1
+            generation = self.generation
+        self.fitter.submit('goto', msg['data'], self.ticker.monotonic(), generation)
+
+
+    def track(self, msg):
+        "Handles the pubsub msg sent when new tracking positions have been set in redis key rempi01_track"
+        self.fitter.submit('track', None, self.ticker.monotonic(), self.generation)
+
+
+    def fit(self, kind, data, received, generation):
+        """Called by the fit worker with kind 'goto' and the payload, or 'track', when the payload is
+           taken from redis, received is the monotonic time the message was received. Builds the new
+           trajectory and swaps it for the one being tracked, unless a goto or altaz received since the
+           job was submitted, at the given generation, has superseded it"""
+        if kind == 'track':
+            # only bother with tracking data if a goto has been received
+            if not self.tracking:
+                return
+            data = self.takepositions()
+            if not data:
+                return
+        # the payload consists of target_name, ra, dec and sets of timestamp,alt,az, see the payload module
+        # typically these alt and az values are for nineteen 30 second intervals (9.5 minutes), these are updated from the server every 4 minutes
+        try:
+            track = payload.decode(data)
+            trajectory = self.maketrajectory(track, received)
+        except ValueError as e:
+            logging.error('%s payload not accepted: %s' % (kind.capitalize(), e))
+            if kind == 'goto':
+                with self._swap:
+                    if generation == self.generation:
+                        # stop any previous tracking
+                        self.trajectory = None
+            return
+        with self._swap:
+            if generation != self.generation:
+                # a newer goto or altaz has been received while this payload was being fitted
+                return
+            if kind == 'track' and self.trajectory is None:
+                # tracking has been stopped while the track payload was being fitted
+                return
+            self.trajectory = trajectory
+            self.target_name = track.name
+            self.ra = track.ra
+            self.dec = track.dec
+        if kind == 'goto':
+            logging.info('Goto received RA %s DEC %s' % (track.ra, track.dec))
+        else:
+            logging.info('Reading tracking data for RA %s DEC %s' % (track.ra, track.dec))
+
+
+    def maketrajectory(self, track, received=None):
+        """Creates the curves from the points of the given payload.Track, and returns a Trajectory
+           pre-evaluating them at every self.interval until the curves expire at the time of the last point"""
+
+        # with the QuadraticInterpolator the points are divided into overlapping segments, each fitted
+        # with a curve, by segment_track, for the usual twenty points at 30 second intervals, this gives four curves
+
         # timestamp[0]                   0 seconds   -------
-        #                  30 seconds
         # timestamp[1]                  30 seconds
-        #                  30 seconds
         # timestamp[2]                  60 seconds    1st curve
-        #                  30 seconds
         # timestamp[3]                  90 seconds
-        #                  30 seconds
         # timestamp[4]                  120 seconds          ======
-        #                  30 seconds
         # timestamp[5]                  150 seconds   ------
-        #                  30 seconds
-        # timestamp[6]                  180 seconds 
-        #                  30 seconds                        2nd curve
+        # timestamp[6]                  180 seconds                 2nd curve
         # timestamp[7]                  210 seconds
-        #                  30 seconds
-        # timestamp[8]                  240 seconds                 #########
-        #                  30 seconds
-        # timestamp[9]                  370 seconds          =======
-        #                  30 seconds
-        # timestamp[10]                 300 seconds 
-        #                  30 seconds
-        # timestamp[11]                 330 seconds                  3rd curve
-        #                  30 seconds
-        # timestamp[12]                 360 seconds 
-        #                  30 seconds
-        # timestamp[13]                 390 seconds                            ++++++++ 
-        #                  30 seconds
-        # timestamp[14]                 420 seconds                   ########
-        #                  30 seconds
-        # timestamp[15]                 450 seconds 
-        #                  30 seconds
-        # timestamp[16]                 480 seconds                             4th curve
-        #                  30 seconds
+        # timestamp[8]                  240 seconds
+        # timestamp[9]                  270 seconds                         #########
+        # timestamp[10]                 300 seconds          ======
+        # timestamp[11]                 330 seconds                         3rd curve
+        # timestamp[12]                 360 seconds
+        # timestamp[13]                 390 seconds                                    ++++++++
+        # timestamp[14]                 420 seconds                         #########
+        # timestamp[15]                 450 seconds
+        # timestamp[16]                 480 seconds                                    4th curve
         # timestamp[17]                 510 seconds
-        #                  30 seconds
         # timestamp[18]                 540 seconds
-        #                  30 seconds
-        # timestamp[19]                 570 seconds                              +++++++
-
+        # timestamp[19]                 570 seconds                                    ++++++++
 
-        # first set of six timestamps  (5 intervals = 2.5 minutes)
-        # dictionary records the curve coefficients against the first timestamp
-        curves[timelist[0]] = self.curve_maker(timelist[:6], time_altaz)
+        # each curve is used from its first timestamp until the first timestamp of the next curve,
+        # the curves expire at 570 seconds, 9.5 minutes, for any interpolator at the time of the last point
+        # longer or denser tracks simply have more curves
 
-        # next curve also covers six timestamps  (5 intervals = 2.5 minutes)
-        # dictionary records the curve coefficients from timelist[4] - an overlap of 30 sec with the previous curve
-        curves[timelist[4]] = self.curve_maker(timelist[4:10], time_altaz)
+        curves = self.INTERPOLATOR(track.times, track.alts, track.azs)
+        return Trajectory(curves, self.interval, track, received)
 
-        # third curve covers seven timestamps  (6 intervals = 3 minutes)
-        # dictionary records the curve coefficients from timelist[8] - an overlap of 30 sec with the previous curve
-        curves[timelist[8]] = self.curve_maker(timelist[8:15], time_altaz)
-
-        # last curve covers seven timestamps  (6 intervals = 3 minutes)
-        # dictionary records the curve coefficients from timelist 13 to the end, an overlap of 30 sec with the previous curve
-        curves[timelist[13]] = self.curve_maker(timelist[13:], time_altaz)
-
-        # note the curve time coverage is less than total curve time, as the curves overlap each other
-
-        # so the curves expire at 570 seconds, 9.5 minutes, or 3 minutes after the start of the last curve
-
-        return curves
-
-
-
-    def curve_maker(self, timeseries, time_altaz):
-        "Returns quadratic coefficients for curves fitting alt and az values over the given timeseries"
-        # altitudes for the timestamps in timeseries
-        altseries = [ time_altaz[tm][0] for tm in timeseries ]
-        popt_alt, pcov_alt = curve_fit(_qcurve, timeseries, altseries)  # curve_fit from scipy.optimize
-
-        # popt_alt is a, b, c parameters for quadratic curve which fits altseries
-
-        # azimuths for the timestamps in timeseries
-        azseries = [ time_altaz[tm][1] for tm in timeseries ]
-
-        # it is possible for azimuths to start at say 356 and then go past 360 to just above zero, causing a discontinuity
-        # for the short series of points here, the continuity may occur if any point is close to 360, ie greater than 270
-        discontinuity = False
-        for az in azseries:
-            if az > 270.0:
-                discontinuity = True
-                break
-        if discontinuity:
-            # add 360 for points which are less than 90
-            new_azseries = [ az if az > 90 else az+360 for az in azseries ]
-            azseries = new_azseries
-       
-        popt_az, pcov_az = curve_fit(_qcurve, timeseries, azseries)
-        # popt_az is a, b, c parameters for quadratic curve which fits azseries
-
-        return popt_alt, popt_az
-      
 
     def altaz(self, msg):
         "Handles the pubsub msg to move to a particular alt, az point, but then does not track"
-        # disable tracking
-        self.tracking = False
-        self.alt, self.az = unpack("dd", msg['data'])
+        alt, az = unpack("dd", msg['data'])
+        with self._swap:
+            # supersede any goto or track being fitted, and disable tracking
+            self.generation += 1
+            self.alt, self.az = alt, az
+            self.trajectory = None
+            self.target_name = ''
+            self.ra = ''
+            self.dec = ''
         logging.info('AltAz received ALT %s AZ %s' % (self.alt, self.az))
-        self.target_name = ''
-        self.ra = ''
-        self.dec = ''
 
 
-    def target_alt_az(self, timestamp, secondcall=False):
-        """Returns the wanted target alt, az at the given timestamp
-           secondcall is to stop a loop occuring with the self.loadpositions function"""
-        if not self.tracking:
+    def target_alt_az(self, timestamp):
+        "Returns the wanted target alt, az at the given timestamp"
+        return self.target_motion(timestamp)[:2]
+
+
+    def target_motion(self, timestamp):
+        """Returns the wanted target alt, az, alt_speed, az_speed at the given timestamp, speeds in degrees
+           per second, taken from the derivatives of the curves. When not tracking, the target is still,
+           so the speeds are zero"""
+        # read the trajectory once, as the fit worker may replace it
+        trajectory = self.trajectory
+        if trajectory is None:
             # no tracking, return the static alt, az set by the altaz method (or by curve expirey)
-            return self.alt, self.az
-        # get the right interpolation curve for the given timestamp
-        if timestamp > self.curvetimes[3]+180:
-            # assume after three minutes, the curves has expired, another goto is required to create new curves
-            self.target_name = ''
-            self.ra = ''
-            self.dec = ''
+            return self.alt, self.az, 0.0, 0.0
+        if timestamp > trajectory.end:
+            # the curves have expired, another goto is required to create new curves
+            if not self.expire(trajectory):
+                # a new trajectory was swapped in as this one expired
+                return self.target_motion(timestamp)
+            return self.alt, self.az, 0.0, 0.0
+        # new positions are loaded by the fit worker as they arrive, so the trajectory is the latest
+        # now get the position and speed from the table evaluated from the curves
+        return trajectory.at(timestamp)
+
+
+    def expire(self, trajectory):
+        """Stops tracking the given expired trajectory, returns False if it has already been
+           replaced by a new one, which is then tracked"""
+        with self._swap:
+            if self.trajectory is not trajectory:
+                return False
             # no tracking data has been received, so assume final position measured from curve is the final altaz point.
-            popt_alt, popt_az = self.curves[self.curvetimes[3]]
-            logging.error('Tracking stopped - no tracking data being received')
-            self.tracking = False
-            # timestamp is set to be end of last curve
-            self.alt, self.az = self.alt_az_from_curve(self.curvetimes[3]+180, popt_alt, popt_az)
-            return self.alt, self.az
-        elif timestamp >= self.curvetimes[3]:
-            # three minutes before curves expire, check if more positions have been given, if so load them
-            if (not secondcall) and self.loadpositions():
-                # self.curves has been updated, so call this function again
-                # but this time with secondcall True, so multiple calls to loadpositions do not occur
-                return self.target_alt_az(timestamp, True)
-            # curves have not been updates, so continue with the existing curves
-            popt_alt, popt_az = self.curves[self.curvetimes[3]]
-        elif timestamp >= self.curvetimes[2]:
-            popt_alt, popt_az = self.curves[self.curvetimes[2]]
-        elif timestamp >= self.curvetimes[1]:
-            popt_alt, popt_az = self.curves[self.curvetimes[1]]
-        else:
-           popt_alt, popt_az = self.curves[self.curvetimes[0]]
-        # now get alt, az from the curve
-        return self.alt_az_from_curve(timestamp, popt_alt, popt_az)
-  
-
-    def alt_az_from_curve(self, timestamp, popt_alt, popt_az):
-        """Return alt, az from the _qcurve given timestamp and popt_alt, popt_az"""
-        alt = _qcurve(timestamp, *popt_alt)
-        if alt > 90.0:
-            alt = 90.0
-        if alt < -90.0:
-            alt = -90.0
-        az =  _qcurve(timestamp, *popt_az)
-        if az > 360.0:
-            az = az - 360.0
-        if az < 0:
-            az = 360.0 + az
-        return alt, az
+            self.alt, self.az = trajectory.at(trajectory.end)[:2]
+            self.trajectory = None
+        self.target_name = ''
+        self.ra = ''
+        self.dec = ''
+        logging.error('Tracking stopped - no tracking data being received')
+        return True
 
 
     def tracking_speed(self, timestamp):
         "Returns alt_speed, az_speed which are the angular speeds the telescope should be moving at in degrees per second at the given timestamp"
-        # gets positions at timestamp - 5 and timestamp +5 and takes difference / 10.0 as the speeds
-        if not self.tracking:
-            return (0.0, 0.0)
-        pos1 = self.target_alt_az(timestamp - 5.0)
-        pos2 = self.target_alt_az(timestamp + 5.0)
-        alt_speed = (pos2[0] - pos1[0])/10.0
-        az1 = pos1[1]
-        az2 = pos2[1]
-        if az1>270 and az2<90:
-            az_speed = (360 + az2 - az1)/10.0
-        elif az2>270 and az1<90:
-            az_speed = (az2-360-az1)/10.0
-        else:
-            az_speed = (az2-az1)/10.0
-        return alt_speed, az_speed
-
-
-    def loadpositions(self):
-        "Checks if new positions have been received, since lasttime, if so return True, if not, False"
-        if not self.tracking:
-            # only bother with tracking data if self.tracking is True
-            # that is, if a goto has been received
-            return False
-        payload = self.rconn.get('rempi01_track')
-        if not payload:
-            return False
-        positions = unpack("10s"+"d"*62, payload)
-        self.target_name = positions[0].rstrip(b'\x00').decode("utf-8")
-        self.ra = positions[1]
-        self.dec = positions[2]
-        # delete the payload to avoid multiple reads of it
-        self.rconn.delete('rempi01_track')
-        # create a dictionary of {timestamp:(alt,az), timestamp:(alt,az),....}
-        # note positions[3:] is used as the first three elements are the name, ra and dec
-        time_altaz = { tstmp : (altdeg, azdeg) for tstmp, altdeg, azdeg in zip(*[iter(positions[3:])]*3) }
-        self.curves = self.createcurves(time_altaz)
-        self.curvetimes = list(self.curves.keys())
-        self.curvetimes.sort()
-        logging.info('Reading tracking data for RA %s DEC %s' % (positions[1], positions[2]))
-        return True
+        return self.target_motion(timestamp)[2:4]
+
+
+    def takepositions(self):
+        "Returns the tracking payload set in redis key rempi01_track, deleting it, or None if none is set"
+        # get and delete the payload in one transaction, so it is read once, and a payload set
+        # between the get and the delete cannot be lost, as GETDEL would, which needs redis 6.2 or later
+        pipe = self.rconn.pipeline(transaction=True)
+        pipe.get('rempi01_track')
+        pipe.delete('rempi01_track')
+        data, deleted = pipe.execute()
+        return data
 
 
     def pin_changed(self,input_name):
@@ -368,7 +662,7 @@ class Telescope(object):
         speed is speed over the previous time interval"""
 
         # This function derives delta_distance which is the distance to move in this
-        # time interval the returned speed will be delta_distance/TIME_INTERVAL
+        # time interval the returned speed will be delta_distance/self.interval
 
         # target_pos and old_target_pos could span the 360->0 discontinuity
         target_distance = target_pos - old_target_pos
@@ -435,121 +729,351 @@ class Telescope(object):
         # break the maximum acceleration
 
         # previous interval distance
-        previous_distance = speed * self.TIME_INTERVAL
-
-        while True:
-            newspeed = delta_distance/self.TIME_INTERVAL
-            acceleration = (newspeed - speed)/self.TIME_INTERVAL
-            if abs(acceleration) < self.MAX_ACCELERATION:
-                # all ok
-                break
-            # acceleration is too great, make delta_distance closer to previous_distance
-            # which reduces acceleration, and test again
-            delta_distance = (5*delta_distance + previous_distance)/6.0
+        previous_distance = speed * self.interval
+
+        # The acceleration is (delta_distance - previous_distance)/self.interval**2, and if too great,
+        # delta_distance was formerly brought closer to previous_distance by repeating
+        # delta_distance = (5*delta_distance + previous_distance)/6.0 until it was within the limit.
+        # Each repeat multiplies the excess distance, delta_distance - previous_distance, by 5/6,
+        # so the number of repeats needed, n, is the smallest with
+        # (5/6)**n * abs(excess) < MAX_ACCELERATION * self.interval**2, which is calculated here
+        # directly, giving the same delta_distance without the loop
+        excess = delta_distance - previous_distance
+        limit = self.MAX_ACCELERATION * self.interval * self.interval
+        if abs(excess) >= limit:
+            repeats = math.floor(math.log(limit/abs(excess))/_LOG_BLEND) + 1
+            if abs(excess) * _BLEND**repeats >= limit:
+                # guard against rounding of the logarithm at the limit
+                repeats += 1
+            delta_distance = previous_distance + excess * _BLEND**repeats
+
+        return delta_distance/self.interval
+
+
+    def get_speeds(self, current_pos, speed, old_target_pos, target_pos):
+        """Return speeds for the next time interval, as get_speed, but for any number of axes or samples
+        at once, each argument being an array, or a sequence, of values. For the two axes of a single
+        tick get_speed is faster, as the numpy overhead for small arrays outweighs the calculation"""
 
-        return newspeed
-
-
-    def __call__(self): 
-        "This actually runs the telescope, this is a blocking call, so run in a thread"
+        # This function derives delta_distance which is the distance to move in this
+        # time interval the returned speed will be delta_distance/self.interval
 
-        # assume initial speed is zero, this could cause accelerationproblems should it be wrong and
-        # the scope actually moving. Requires some way of finding initial scope position and speed
-        speed_alt = 0
-        speed_az = 0
+        current_pos = np.asarray(current_pos, dtype=float)
+        speed = np.asarray(speed, dtype=float)
+        old_target_pos = np.asarray(old_target_pos, dtype=float)
+        target_pos = np.asarray(target_pos, dtype=float)
 
-        # self.alt, self.az are values for a stopped scope, set by altaz method, or when tracking information
-        # has stopped. Assume they can be used as the initial value, should eventually be taken by hardware measurement
-        alt = self.alt
-        az = self.az
+        # target_pos and old_target_pos could span the 360->0 discontinuity
+        # example tp = 350, otp = 10, so distance is 340, this changes to 340 - 360 = -20
+        # example tp = 5, otp = 350, so distance is -345, this changes to -345 + 360 = 15
+        target_distance = target_pos - old_target_pos
+        target_distance = target_distance - 360.0*(target_distance > 180) + 360.0*(target_distance < -180)
 
-        # get target position
-        now_timestamp = datetime.utcnow().replace(tzinfo=timezone.utc).timestamp()
-        old_target_alt, old_target_az = self.target_alt_az(now_timestamp)
-    
+        # the distance between scope and target at the start of the interval
+        # this is an 'error distance', again it could span the 360->0 discontinuity
+        distance = old_target_pos - current_pos
+        distance = distance - 360.0*(distance > 180) + 360.0*(distance < -180)
 
-        while True:
+        # in calculating speed, if this distance is zero, then speed will be
+        # equal to the target speed only.  However the greater this distance, then
+        # the scope speed needs to catch up.
 
-            # alt, az is the current position at the start of the time interval
-            # old_target_alt, old_target_az is the target position at the start of the time interval
+        # delta_distance will now be calculated, and will be the actual distance moved
+        # in the time interval. As this defines the speed of the scope, it has to be
+        # limited to provide the maximum velocity.
 
-            # get the target position and speed at TIME_INTERVAL in the future
+        # the value 'DECELERATION_DISTANCE' is the distance over which deceleration occurs.
+        # If distance to move is greater than this deceleration distance; the scope is far
+        # from the target, then the delta_distance is the self.max_delta_distance
+        # and hence the scope moves as fast as possible
 
-            # get the time at TIME_INTERVAL in the future
-            future_time = datetime.utcnow()+timedelta(seconds=self.TIME_INTERVAL)
-            future_timestamp = future_time.replace(tzinfo=timezone.utc).timestamp()
+        # otherwise the speed has to become lower as the scope nears the target, a simple ramp
+        # down of delta_distance which is zero when distance is zero, to which the target
+        # movement is added, so when the scope is on target its speed matches the target speed.
+        # This is limited to the maximum speed
+        delta_distance = np.clip(self.max_delta_distance * distance / self.DECELERATION_DISTANCE + target_distance,
+                                 -self.max_delta_distance, self.max_delta_distance)
+        delta_distance = np.where(distance > self.DECELERATION_DISTANCE, self.max_delta_distance, delta_distance)
+        delta_distance = np.where(distance < -self.DECELERATION_DISTANCE, -self.max_delta_distance, delta_distance)
 
-            target_alt, target_az = self.target_alt_az(future_timestamp)
-            #target_speed_alt, target_speed_az = self.tracking_speed(future_timestamp)
+        # so delta_distance worked out, but does the speed change
+        # break the maximum acceleration
 
-            #target_speed_alt = (target_alt_old - target_alt)/self.TIME_INTERVAL
-            #target_speed_az = (target_az_old - target_az)/self.TIME_INTERVAL
-            # these values are recorded for status, and web displays
-            self.rconn.set("rempi01_target_alt", "{:1.5f}".format(target_alt))
-            self.rconn.set("rempi01_target_az", "{:1.5f}".format(target_az))
-            #self.rconn.set("rempi01_target_alt_speed", "{:1.5f}".format(target_speed_alt))
-            #self.rconn.set("rempi01_target_az_speed", "{:1.5f}".format(target_speed_az))
+        # previous interval distance
+        previous_distance = speed * self.interval
 
-            # speed_alt and speed_az are the speeds required over the next time interval, note
-            # they may be different to target_speed_alt and target_speed_az which are the speeds
-            # of the target itself
+        # the number of repeats of the acceleration limit is found as in get_speed
+        excess = delta_distance - previous_distance
+        size = np.abs(excess)
+        limit = self.MAX_ACCELERATION * self.interval * self.interval
+        over = size >= limit
+        repeats = np.floor(np.log(limit/np.where(over, size, limit))/_LOG_BLEND) + 1.0
+        # guard against rounding of the logarithms at the limit
+        repeats += (size * _BLEND**repeats >= limit)
+        delta_distance = np.where(over, previous_distance + excess * _BLEND**repeats, delta_distance)
 
-            # it may be that the target is some distance away, in which case speed_alt and speed_az
-            # have to be faster to catch up with it, or if very close, the speeds will match.
-            # The self.get_speed method works out the required speed, taking max velocities and
-            # acceleration into account
+        return delta_distance/self.interval
 
-            # get speed for the next time interval, where targets are taken for TIME_INTERVAL time in the future
-            speed_alt = self.get_speed(alt, speed_alt, old_target_alt, target_alt)
-            speed_az = self.get_speed(az, speed_az, old_target_az, target_az)
 
-            # old_target_alt and old_target_az will (after the next time interval) become the target
-            # position at the beginning of the interval.
+    def start(self):
+        "Sets the initial state of the control loop, and starts its ticks from now"
 
-            old_target_alt = target_alt
-            old_target_az = target_az
+        # assume initial speed is zero, this could cause accelerationproblems should it be wrong and
+        # the scope actually moving. Requires some way of finding initial scope position and speed
+        self.speed_alt = 0.0
+        self.speed_az = 0.0
 
-            ######## call motor control with speed_alt, speed_az  ##########
+        # self.alt, self.az are values for a stopped scope, set by altaz method, or when tracking information
+        # has stopped. Assume they can be used as the initial value, should eventually be taken by hardware measurement
+        self.current_alt = self.alt
+        self.current_az = self.az
 
-            sleep(self.TIME_INTERVAL)
+        # start the ticks from now
+        self.apply_interval()
+        self.ticker.start()
 
-            # get new position after the time interval,
-            # this will, in due course, be measured from scope sensors
-            alt = alt + speed_alt * self.TIME_INTERVAL
-            az = az + speed_az * self.TIME_INTERVAL
+        # get target position
+        now_timestamp = self.ticker.timestamp()
+        self.old_target_alt, self.old_target_az = self.target_alt_az(now_timestamp)
+
+
+    def set_interval(self, interval):
+        """Sets the control loop interval in seconds, which is applied at the next tick. Raises ValueError if
+           the interval is shorter than MIN_INTERVAL, or if the measured cost of a tick is too great for it"""
+        if interval < self.MIN_INTERVAL:
+            raise ValueError("The interval cannot be less than %s seconds" % (self.MIN_INTERVAL,))
+        cost = self.ticker.percentile(99)
+        if (cost is not None) and (cost > interval*self.LOAD_LIMIT):
+            raise ValueError("The 99th percentile tick duration of %.1f ms is too long for an interval of %s seconds" % (cost*1000, interval))
+        self._new_interval = interval
+
+
+    def control_rate(self, msg):
+        "Handles the pubsub msg giving a new control loop interval in seconds, as a string"
+        try:
+            interval = float(msg['data'])
+            self.set_interval(interval)
+        except ValueError as e:
+            logging.error('Control interval not accepted: %s' % (e,))
+            return
+        logging.info('Control interval set to %s seconds' % (interval,))
+
+
+    def apply_interval(self):
+        """Called by the control loop thread, applies any interval set by set_interval, and sets the
+           numbers of ticks between publishing telemetry and statistics for the interval"""
+        if self._new_interval is not None:
+            self.interval = self._new_interval
+            self._new_interval = None
+            self.ticker.interval = self.interval
+            self.max_delta_distance = self.MAX_SPEED * self.interval
+            # the interval of the speed of the last tick may have been different, but the speed is still
+            # valid. Trajectories built before the change keep their own table interval, which is fine
+        self._telemetry_ticks = max(1, int(round(self.TELEMETRY_INTERVAL/self.interval)))
+        self._stats_ticks = max(1, int(round(self.TICK_STATS_INTERVAL/self.interval)))
+        self._summary_ticks = max(1, int(round(self.TRACKING_SUMMARY_INTERVAL/self.interval)))
+
+
+    def tick(self):
+        """Runs one time interval of the control loop, setting the speed for the interval, and waiting
+           until its end. self.start() should be called before the first tick"""
+
+        # self.current_alt, self.current_az is the current position at the start of the time interval
+        # self.old_target_alt, self.old_target_az is the target position at the start of the time interval
+
+        if self._new_interval is not None:
+            self.apply_interval()
+
+        # telemetry is published every _telemetry_ticks, so redis writes do not increase with the tick rate
+        publish = not self.ticker.ticks % self._telemetry_ticks
+
+        # get the target position and speed at self.interval in the future
+
+        # get the time at self.interval in the future, the deadline of the next tick
+        future_timestamp = self.ticker.timestamp(self.ticker.deadline + self.interval)
+
+        trajectory = self.trajectory
+        if trajectory is not self._used_trajectory:
+            # a new trajectory, record the time from its payload being received to this first use
+            self._used_trajectory = trajectory
+            if (trajectory is not None) and (trajectory.received is not None):
+                latency = self.ticker.monotonic() - trajectory.received
+                self.latency_count += 1
+                self.latency_sum += latency
+                self.latency_last = latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+
+        # with its speed, from the derivatives of the curves, in the same table lookup
+        target_alt, target_az, target_speed_alt, target_speed_az = self.target_motion(future_timestamp)
+
+        if publish:
+            # these values are recorded for status, and web displays
+            self.telemetry.set("rempi01_target_alt", "{:1.5f}".format(target_alt))
+            self.telemetry.set("rempi01_target_az", "{:1.5f}".format(target_az))
+            self.telemetry.set("rempi01_target_alt_speed", "{:1.5f}".format(target_speed_alt))
+            self.telemetry.set("rempi01_target_az_speed", "{:1.5f}".format(target_speed_az))
+
+        # speed_alt and speed_az are the speeds required over the next time interval, note
+        # they may be different to target_speed_alt and target_speed_az which are the speeds
+        # of the target itself
+
+        # it may be that the target is some distance away, in which case speed_alt and speed_az
+        # have to be faster to catch up with it, or if very close, the speeds will match.
+        # The self.get_speed method works out the required speed, taking max velocities and
+        # acceleration into account
+
+        # get speed for the next time interval, where targets are taken for self.interval time in the future
+        self.speed_alt = self.get_speed(self.current_alt, self.speed_alt, self.old_target_alt, target_alt)
+        self.speed_az = self.get_speed(self.current_az, self.speed_az, self.old_target_az, target_az)
+
+        # old_target_alt and old_target_az will (after the next time interval) become the target
+        # position at the beginning of the interval.
+
+        self.old_target_alt = target_alt
+        self.old_target_az = target_az
+
+        # drive the motors at speed_alt, speed_az, their outputs are only changed if the duty cycles differ
+        try:
+            self.motor1.set_rate(self.speed_alt, self.ticker.woke)
+            self.motor2.set_rate(self.speed_az, self.ticker.woke)
+        except Exception:
+            # rather than end the control loop with the outputs left on, stop both motors
+            logging.exception('Failed to set the motor rates, stopping the motors')
+            self.motor1.command(motors.STOP)
+            self.motor2.command(motors.STOP)
+            self.speed_alt = 0.0
+            self.speed_az = 0.0
+
+        # wait for the next tick, intervals is normally one, but more if ticks have been skipped
+        intervals = self.ticker.wait()
+
+        # get new position after the time interval,
+        # this will, in due course, be measured from scope sensors
+        alt = self.current_alt + self.speed_alt * self.interval * intervals
+        az = self.current_az + self.speed_az * self.interval * intervals
+
+        while az >= 360.0:
+            az = az - 360.0
+        while az < 0.0:
+            az = az + 360.0
 
-            while az >= 360.0:
-                az = az - 360.0
-            while az < 0.0:
-                az = az + 360.0
+        if alt > 90.0:
+            alt = 90.0
+        if alt < -90.0:
+            alt = -90.0
 
-            if alt > 90.0:
-                alt = 90.0
-            if alt < -90.0:
-                alt = -90.0
+        self.current_alt = alt
+        self.current_az = az
 
+        current_timestamp = self.ticker.timestamp()
+        if publish:
             # set values into redis for reading by the web service, and also
             # pack timestamp,alt,az into a structure of three floats, for sending
             # to remote server 
-            self.rconn.set("rempi01_current_time", future_time.strftime("%H:%M:%S.%f"))
-            self.rconn.set("rempi01_current_alt", "{:1.5f}".format(alt))
-            self.rconn.set("rempi01_current_az", "{:1.5f}".format(az))
-            self.rconn.set("telescope_position", pack("ddd", future_timestamp, alt, az))
-
-            # current positions should now be equal to the previous target positions for the end of the time interval
-            # error_alt = target_alt - alt
-            # error_az = target_az - az
-            # print(error_alt, error_az)
-
+            current_time = datetime.fromtimestamp(current_timestamp, timezone.utc)
+            self.telemetry.set("rempi01_current_time", current_time.strftime("%H:%M:%S.%f"))
+            self.telemetry.set("rempi01_current_alt", "{:1.5f}".format(alt))
+            self.telemetry.set("rempi01_current_az", "{:1.5f}".format(az))
+            position = pack("ddd", current_timestamp, alt, az)
+            self.telemetry.set("telescope_position", position)
+            # and append the packed position to the position history stream, read by rempicomms.history
+            self.telemetry.xadd("rempi01_position_history", {"p": position}, self.POSITION_HISTORY)
+            # and notify pimqtt of the position, with the motion state, from which it decides whether to send it
+            self.telemetry.publish("position", position + self.motion_state(target_alt, target_az).encode("utf-8"))
+
+        # current positions should now be equal to the previous target positions for the end of the time interval
+        # record these, and so the tracking error, in the tracking log
+        self.tracklog.record(current_timestamp, target_alt, target_az, alt, az, self.speed_alt, self.speed_az)
+
+        if not self.ticker.ticks % self._summary_ticks:
+            # publish the rolling rms errors, and the maximum errors since the last summary
+            summary = self.tracklog.summary()
+            self.telemetry.hset("rempi01_tracking", { key:("{:1.6f}".format(value) if isinstance(value, float) else value)
+                                                      for key, value in summary.items() })
+            self.tracklog.reset_max()
+
+        if not self.ticker.ticks % self._stats_ticks:
+            # publish tick counts, jitter and redis times, with statistics per TICK_STATS_INTERVAL
+            self.telemetry.hset("rempi01_tick_stats", self.ticker.stats())
+            self.telemetry.hset("rempi01_tick_stats", self.telemetry.stats())
+            self.telemetry.hset("rempi01_tick_stats", self.latency_stats())
+            self.telemetry.hset("rempi01_tick_stats", self.motor1.rate_stats())
+            self.telemetry.hset("rempi01_tick_stats", self.motor2.rate_stats())
+            self.ticker.reset_jitter()
+            self.telemetry.reset_stats()
+            self.reset_latency()
+            self.motor1.reset_rate_stats()
+            self.motor2.reset_rate_stats()
+
+        if self._dump_requested:
+            # dump the tracking log here, on the control loop thread, so no row is recorded during the dump
+            self._dump_requested = False
+            self.telemetry.set("rempi01_tracking_log", self.tracklog.dump())
+
+        # and send any values of this tick to redis in one round trip
+        self.telemetry.flush()
+
+
+    def motion_state(self, target_alt, target_az):
+        """Returns STOPPED if neither motor is running, TRACKING if following a trajectory within TRACKING_ERROR
+           of the target position on each axis, otherwise SLEWING"""
+        if (self.motor1.status == motors.STOPPED) and (self.motor2.status == motors.STOPPED):
+            return STOPPED
+        if self.tracking and (abs(target_alt - self.current_alt) <= self.TRACKING_ERROR) and \
+                             (abs((target_az - self.current_az + 180.0) % 360.0 - 180.0) <= self.TRACKING_ERROR):
+            return TRACKING
+        return SLEWING
+
+
+    def latency_stats(self):
+        """Returns a dictionary of the count of new trajectories used since the last reset_latency, and of
+           the times in milliseconds from their payloads being received to their first use by the control loop"""
+        return { 'trajectories': self.latency_count,
+                 'fit_errors': self.fitter.errors,
+                 'trajectory_latency_mean_ms': round(self.latency_sum/self.latency_count*1000, 3) if self.latency_count else 0.0,
+                 'trajectory_latency_max_ms': round(self.latency_max*1000, 3),
+                 'trajectory_latency_last_ms': round(self.latency_last*1000, 3) }
+
+
+    def selftest(self, seconds=10.0, intervals=None):
+        """Runs the control loop for the given seconds at each of the intervals, by default SELFTEST_INTERVALS,
+           returning a list of dictionaries of the interval, the achieved tick rate per second, the 50th and
+           99th percentile tick durations in milliseconds and the number of overruns. This runs the loop
+           itself, so should not be called while the telescope is running"""
+        if intervals is None:
+            intervals = self.SELFTEST_INTERVALS
+        original = self.interval
+        results = []
+        for interval in intervals:
+            # measuring the tick cost is the purpose of the test, so the interval is not validated
+            self._new_interval = interval
+            self.start()
+            self.ticker.reset_durations()
+            ticks = self.ticker.ticks
+            overruns = self.ticker.overruns
+            began = self.ticker.monotonic()
+            while self.ticker.monotonic() - began < seconds:
+                self.tick()
+            elapsed = self.ticker.monotonic() - began
+            results.append({ 'interval': interval,
+                             'rate': round((self.ticker.ticks - ticks)/elapsed, 3),
+                             'tick_p50_ms': round(self.ticker.percentile(50)*1000, 3),
+                             'tick_p99_ms': round(self.ticker.percentile(99)*1000, 3),
+                             'overruns': self.ticker.overruns - overruns })
+        self._new_interval = original
+        self.apply_interval()
+        return results
+
+
+    def dump_tracking(self, msg):
+        """Receives a message to dump the tracking log, the rows it holds are set into redis key
+           rempi01_tracking_log, as bytes read by tracklog.decode, at the end of the next tick"""
+        self._dump_requested = True
 
-    
-
-
-
-
-        
-
-
-
- 
 
+    def __call__(self): 
+        "This actually runs the telescope, this is a blocking call, so run in a thread"
+        self.start()
+        while True:
+            self.tick()
@@ -0,0 +1,166 @@
+################################################################
+#
+# This module defines a Ticker, which runs a fixed rate
+# loop, such as the telescope control loop
+#
+################################################################
+
+import time, logging
+
+# A loop which sleeps for a fixed interval after doing its work runs slower than
+# intended, by however long the work takes, and one timed with the wall clock jumps
+# whenever ntp steps the clock. The Ticker instead sets a deadline for each tick on the
+# monotonic clock, each deadline exactly one interval after the last, and sleeps until
+# it. Astronomical time is still needed for each tick, so the offset between the wall
+# clock and the monotonic clock is measured at each tick, and used to convert the
+# deadlines to unix timestamps.
+
+# If the work of a tick takes longer than the interval, the next deadline has already
+# passed, this is an overrun. The policy then decides what happens next:
+
+# SKIP - the missed deadlines are dropped, and the next tick waits for the next
+#        deadline in the future, so the ticks keep to their original phase
+
+# CATCHUP - the missed ticks are run immediately, one after the other, until the
+#           loop is back on time
+
+# The duration of the work of each tick, from waking to the next call of wait, is recorded
+# for the last DURATIONS ticks, giving percentiles of the loop cost, against which a
+# shorter interval can be judged. The interval may be changed between ticks.
+
+SKIP = 'skip'
+CATCHUP = 'catchup'
+
+
+class Ticker(object):
+
+    # a change in the wall clock offset greater than this, in seconds, is logged as a clock step
+    STEP_THRESHOLD = 0.1
+
+    # the number of tick durations held
+    DURATIONS = 1000
+
+    def __init__(self, interval, policy=SKIP, monotonic=time.monotonic, walltime=time.time, sleep=time.sleep):
+        """interval is the tick interval in seconds, policy is SKIP or CATCHUP
+           monotonic, walltime and sleep are the clock functions, which could be replaced for testing"""
+        if policy not in (SKIP, CATCHUP):
+            raise ValueError("policy should be %s or %s" % (SKIP, CATCHUP))
+        self.interval = interval
+        self.policy = policy
+        self.monotonic = monotonic
+        self.walltime = walltime
+        self.sleep = sleep
+        # the monotonic time of the current tick
+        self.deadline = monotonic()
+        # walltime - monotonic
+        self.offset = walltime() - self.deadline
+        # counts since start
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.clock_steps = 0
+        self.reset_jitter()
+        self.reset_durations()
+        # the monotonic time the current tick woke
+        self.woke = self.deadline
+
+
+    def start(self):
+        "Sets the current time as the first tick"
+        self.deadline = self.monotonic()
+        self.offset = self.walltime() - self.deadline
+        self.woke = self.deadline
+
+
+    def timestamp(self, monotonic_time=None):
+        "Returns the unix timestamp of the given monotonic time, or of the current tick deadline if not given"
+        if monotonic_time is None:
+            monotonic_time = self.deadline
+        return monotonic_time + self.offset
+
+
+    def reset_jitter(self):
+        "Resets the jitter statistics, which are accumulated from the time of this call"
+        self.jitter_count = 0
+        self.jitter_sum = 0.0
+        self.jitter_sumsq = 0.0
+        self.jitter_max = 0.0
+
+
+    def reset_durations(self):
+        "Clears the tick durations"
+        self.durations = [0.0]*self.DURATIONS
+        self.duration_index = 0
+        self.duration_count = 0
+
+
+    def percentile(self, percent):
+        "Returns the given percentile of the tick durations held, in seconds, or None if none are held"
+        if not self.duration_count:
+            return None
+        durations = sorted(self.durations[:self.duration_count])
+        return durations[min(int(len(durations)*percent/100.0), len(durations) - 1)]
+
+
+    def wait(self):
+        """Sleeps until the deadline of the next tick, and returns the number of intervals
+           since the previous tick, normally 1, but more if ticks have been skipped"""
+        intervals = 1
+        self.deadline += self.interval
+        now = self.monotonic()
+        # the duration of the work of this tick
+        self.durations[self.duration_index] = now - self.woke
+        self.duration_index = (self.duration_index + 1) % self.DURATIONS
+        if self.duration_count < self.DURATIONS:
+            self.duration_count += 1
+        if now > self.deadline:
+            # the work of the previous tick has overrun this deadline
+            self.overruns += 1
+            if self.policy == SKIP:
+                missed = int((now - self.deadline)/self.interval) + 1
+                self.deadline += missed*self.interval
+                self.skipped += missed
+                intervals += missed
+        if now < self.deadline:
+            self.sleep(self.deadline - now)
+            now = self.monotonic()
+        self.woke = now
+        self.ticks += 1
+        # jitter is the lateness of this tick against its deadline
+        jitter = now - self.deadline
+        self.jitter_count += 1
+        self.jitter_sum += jitter
+        self.jitter_sumsq += jitter*jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        # measure the wall clock offset, so timestamps follow any change to the wall clock
+        offset = self.walltime() - now
+        if abs(offset - self.offset) > self.STEP_THRESHOLD:
+            self.clock_steps += 1
+            logging.warning('Wall clock stepped by %.3f seconds' % (offset - self.offset,))
+        self.offset = offset
+        return intervals
+
+
+    def stats(self):
+        """Returns a dictionary of tick counts, jitter statistics in milliseconds since
+           the last call to reset_jitter, and percentiles of the tick durations held"""
+        if self.jitter_count:
+            mean = self.jitter_sum/self.jitter_count
+            rms = (self.jitter_sumsq/self.jitter_count)**0.5
+        else:
+            mean = 0.0
+            rms = 0.0
+        p50 = self.percentile(50) or 0.0
+        p99 = self.percentile(99) or 0.0
+        return { 'interval': self.interval,
+                 'policy': self.policy,
+                 'ticks': self.ticks,
+                 'overruns': self.overruns,
+                 'skipped': self.skipped,
+                 'clock_steps': self.clock_steps,
+                 'jitter_mean_ms': round(mean*1000, 3),
+                 'jitter_rms_ms': round(rms*1000, 3),
+                 'jitter_max_ms': round(self.jitter_max*1000, 3),
+                 'tick_p50_ms': round(p50*1000, 3),
+                 'tick_p99_ms': round(p99*1000, 3) }
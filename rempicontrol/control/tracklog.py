@@ -0,0 +1,126 @@
+################################################################
+#
+# This module defines a TrackingLog, a fixed size ring buffer
+# recording how well the telescope follows its target
+#
+################################################################
+
+import numpy as np
+
+
+# columns of the log, each row is a tick
+TIME, TARGET_ALT, TARGET_AZ, ALT, AZ, SPEED_ALT, SPEED_AZ, ERROR_ALT, ERROR_AZ = range(9)
+
+COLUMNS = ('time', 'target_alt', 'target_az', 'alt', 'az', 'speed_alt', 'speed_az', 'error_alt', 'error_az')
+
+# the log is dumped as the rows in time order, oldest first, each of the nine
+# columns as a little endian float64
+DTYPE = np.dtype("<f8")
+
+
+# The log is an array allocated once, rows are written in turn, overwriting the oldest
+# once the buffer is full, so recording a tick allocates nothing. The rolling statistics
+# are of the errors of the rows in the buffer, the sums of squared errors are updated as
+# each row is written, adding the new error and subtracting the one it overwrites. So that
+# rounding does not accumulate, the sums are recalculated from the buffer each time
+# it wraps around.
+
+
+class TrackingLog(object):
+
+    def __init__(self, size):
+        "size is the number of ticks held in the log"
+        self.size = size
+        self.data = np.zeros((size, len(COLUMNS)), dtype=DTYPE)
+        # views of each row, so writing a row does not create one
+        self._rows = list(self.data)
+        self._alt_errors = self.data[:, ERROR_ALT]
+        self._az_errors = self.data[:, ERROR_AZ]
+        self.clear()
+
+
+    def clear(self):
+        "Empties the log"
+        self.data[:] = 0.0
+        # the row to be written next, and the number of rows held
+        self.index = 0
+        self.count = 0
+        # sums of squared errors of the rows held
+        self.sumsq_alt = 0.0
+        self.sumsq_az = 0.0
+        # maximum absolute errors since the last reset_max
+        self.reset_max()
+
+
+    def reset_max(self):
+        "Resets the maximum errors, which are then taken from the rows recorded after this call"
+        self.max_alt = 0.0
+        self.max_az = 0.0
+
+
+    def record(self, timestamp, target_alt, target_az, alt, az, speed_alt, speed_az):
+        "Records a tick, the errors are target - actual, with the azimuth error in the range -180 to 180"
+        error_alt = target_alt - alt
+        error_az = (target_az - az + 180.0) % 360.0 - 180.0
+        row = self._rows[self.index]
+        if self.count == self.size:
+            # the oldest row is overwritten, remove its errors from the sums
+            self.sumsq_alt -= row[ERROR_ALT]*row[ERROR_ALT]
+            self.sumsq_az -= row[ERROR_AZ]*row[ERROR_AZ]
+        else:
+            self.count += 1
+        row[TIME] = timestamp
+        row[TARGET_ALT] = target_alt
+        row[TARGET_AZ] = target_az
+        row[ALT] = alt
+        row[AZ] = az
+        row[SPEED_ALT] = speed_alt
+        row[SPEED_AZ] = speed_az
+        row[ERROR_ALT] = error_alt
+        row[ERROR_AZ] = error_az
+        self.sumsq_alt += error_alt*error_alt
+        self.sumsq_az += error_az*error_az
+        if abs(error_alt) > self.max_alt:
+            self.max_alt = abs(error_alt)
+        if abs(error_az) > self.max_az:
+            self.max_az = abs(error_az)
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+            # recalculate the sums, np.dot of a column with itself does not allocate an array
+            self.sumsq_alt = float(np.dot(self._alt_errors, self._alt_errors))
+            self.sumsq_az = float(np.dot(self._az_errors, self._az_errors))
+
+
+    def summary(self):
+        """Returns a dictionary of the rms errors of the rows held, and of the maximum errors
+           since the last reset_max, in degrees, and of the number of rows and the time they span"""
+        if not self.count:
+            return { 'ticks': 0, 'seconds': 0.0, 'error_alt_rms': 0.0, 'error_az_rms': 0.0,
+                     'error_alt_max': 0.0, 'error_az_max': 0.0 }
+        latest = self._rows[self.index - 1]
+        oldest = self._rows[self.index] if self.count == self.size else self._rows[0]
+        # the sums could fall fractionally below zero by rounding, as rows are removed
+        return { 'ticks': self.count,
+                 'seconds': round(float(latest[TIME] - oldest[TIME]), 3),
+                 'error_alt_rms': float(max(self.sumsq_alt, 0.0)/self.count)**0.5,
+                 'error_az_rms': float(max(self.sumsq_az, 0.0)/self.count)**0.5,
+                 'error_alt_max': float(self.max_alt),
+                 'error_az_max': float(self.max_az) }
+
+
+    def rows(self):
+        "Returns a copy of the rows held, in time order, oldest first"
+        if self.count < self.size:
+            return self.data[:self.count].copy()
+        return np.concatenate((self.data[self.index:], self.data[:self.index]))
+
+
+    def dump(self):
+        "Returns the rows held as bytes, as read by decode"
+        return self.rows().tobytes()
+
+
+def decode(data):
+    "Returns the rows of a dumped log as a numpy array, with a row per tick and a column per COLUMNS"
+    return np.frombuffer(data, dtype=DTYPE).reshape(-1, len(COLUMNS))
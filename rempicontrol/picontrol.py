@@ -32,7 +32,7 @@ from logging.handlers import RotatingFileHandler
 
 from redis import StrictRedis
 
-from control import hardware, schedule, door, led, temperature, telescope
+from control import hardware, schedule, door, led, temperature, telescope, dispatch
 
 # have a pause to ensure various services are up and working
 time.sleep(3)
@@ -66,17 +66,22 @@ state = {
 # Telescope is the instrument being controlled
 Telescope = telescope.Telescope(rconn, state)
 
-pubsub = rconn.pubsub(ignore_subscribe_messages=True)
+# the dispatcher calls the handler of each channel as its messages arrive
+dispatcher = dispatch.Dispatcher(rconn)
 
 # subscribe to control channels
 
-pubsub.subscribe(control01=state['door'])
-pubsub.subscribe(control02=state['led'])
-pubsub.subscribe(control03=state['temperature'].handle)  # handle is a method which gets tempearture and store it to redis
-pubsub.subscribe(motor1control=Telescope.motor1)  # probably to be removed from here - as motors will be controlled by the Telescope object
-pubsub.subscribe(motor2control=Telescope.motor2)  # directly, and not via redis - allowed here for testing from web server
-pubsub.subscribe(goto=Telescope.goto)        # calls the goto message of the Telescope object
-pubsub.subscribe(altaz=Telescope.altaz)      # calls the altaz message of the Telescope object
+dispatcher.subscribe(control01=state['door'])
+dispatcher.subscribe(control02=state['led'])
+dispatcher.subscribe(control03=state['temperature'].handle)  # handle is a method which gets tempearture and store it to redis
+dispatcher.subscribe(motor1control=Telescope.motor1)  # probably to be removed from here - as motors will be controlled by the Telescope object
+dispatcher.subscribe(motor2control=Telescope.motor2)  # directly, and not via redis - allowed here for testing from web server
+dispatcher.subscribe(goto=Telescope.goto)        # calls the goto message of the Telescope object
+dispatcher.subscribe(altaz=Telescope.altaz)      # calls the altaz message of the Telescope object
+dispatcher.subscribe(track=Telescope.track)      # sent when new tracking positions are set in redis key rempi01_track
+dispatcher.subscribe(target=Telescope.target_changed)  # sent if another process changes the redis target name, ra or dec
+dispatcher.subscribe(trackinglog=Telescope.dump_tracking)  # dumps the tracking log to redis key rempi01_tracking_log
+dispatcher.subscribe(controlrate=Telescope.control_rate)  # sets the control loop interval, in seconds
 
 ### create input listener callback
 
@@ -110,11 +115,7 @@ run_telescope.start()
 logging.info('Telescope control started')
 print("picontrol started")
 
-# blocks and listens to redis
-while True:
-    message = pubsub.get_message()
-    if message:
-        print(message)
-    time.sleep(0.1)
+# blocks and listens to redis, handling messages as they arrive
+dispatcher()
 
 
@@ -14,6 +14,10 @@
 # It runs a schedular to maintain a 10 minute MQTT heartbeat,
 # and sends a sensor status messages every fifteen minutes
 #
+# It sends the telescope position as rempicontrol notifies it,
+# at a rate depending on whether the scope is slewing, tracking
+# or stopped, and sends every position notified in batched frames
+#
 #
 #################################################################
 
@@ -25,7 +29,7 @@ import paho.mqtt.client as mqtt
 
 from redis import StrictRedis
 
-from rempicomms import communications, schedule
+from rempicomms import communications, schedule, positions, frames, inbound, flags
 
 # mqtt parameters
 
@@ -54,20 +58,24 @@ def _on_message(client, userdata, message):
     userdata['comms_countdown'] = 4
 
     print(message.topic)
+
+    # the handlers make redis calls, so are passed to the inbound queue worker, rather
+    # than holding up this network thread, goto, altaz and track are handled ahead of others
+    inbound_queue = userdata['inbound']
    
     if message.topic.startswith('From_WebServer/Outputs') or message.topic.startswith('From_ServerEngine/Outputs'):
-        communications.action(client, userdata, message)
+        inbound_queue.submit(inbound.CONTROL, communications.action, client, userdata, message)
     elif message.topic == 'From_ServerEngine/Telescope/track':
-        communications.telescope_track(client, userdata, message)
+        inbound_queue.submit(inbound.TELESCOPE, communications.telescope_track, client, userdata, message)
     elif message.topic == 'From_WebServer/Telescope/goto':
-        communications.telescope_goto(client, userdata, message)
+        inbound_queue.submit(inbound.TELESCOPE, communications.telescope_goto, client, userdata, message)
     elif message.topic == 'From_WebServer/Telescope/altaz':
-        communications.telescope_altaz(client, userdata, message)
+        inbound_queue.submit(inbound.TELESCOPE, communications.telescope_altaz, client, userdata, message)
     elif message.topic == 'From_ServerEngine/Inputs':
         # an initial full status request
         payload = message.payload.decode("utf-8")
         if payload == 'status_request':
-            communications.status_request(client, userdata)
+            inbound_queue.submit(inbound.STATUS, communications.status_request, client, userdata)
 
 
 def _on_connect(client, userdata, flags, rc):
@@ -111,6 +119,24 @@ def alert02_handler(msg):
         communications.led_status(mqtt_client, userdata)
 
 
+def send_position(position):
+    "Sends the packed structure: timestamp, alt, az, called by the position policy"
+    telescope_topic = userdata['from_topic'] + '/Telescope/position'
+    mqtt_client.publish(topic=telescope_topic, payload=position)
+
+
+def send_frame(frame):
+    "Sends a batched frame of positions, as rempicomms.frames, called by the position batcher"
+    frames_topic = userdata['from_topic'] + '/Telescope/positions'
+    mqtt_client.publish(topic=frames_topic, payload=frame)
+
+
+def position_handler(msg):
+    "Handles the pubsub position notification from rempicontrol"
+    position_policy(msg)
+    position_batcher(msg)
+
+
 
 if __name__ == "__main__":
 
@@ -123,6 +149,12 @@ if __name__ == "__main__":
     # set rconn into userdata
     userdata['rconn'] = rconn
 
+    # and the queue of received messages to be handled
+    userdata['inbound'] = inbound.InboundQueue()
+
+    # and the cache of control flags, such as rempi01_web_control, checked by the handlers
+    userdata['flags'] = flags.FlagCache(rconn)
+
     # create an mqtt client instance
     mqtt_client = mqtt.Client(userdata=userdata)
 
@@ -156,33 +188,36 @@ if __name__ == "__main__":
     print("Scheduled events started")
 
 
-    # subscribe to alert01, alert02.., etc
-    pubsub = rconn.pubsub()
+    # the position policy sends each position notified by rempicontrol, as required
+    position_policy = positions.PositionPolicy(send_position)
+    # and the batcher sends them all, as frames
+    position_batcher = frames.PositionBatcher(send_frame)
+
+    # subscribe to alert01, alert02.., etc, and position notifications
+    pubsub = rconn.pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe(alert01 = alert01_handler)
     pubsub.subscribe(alert02 = alert02_handler)
+    pubsub.subscribe(**{positions.CHANNEL: position_handler})
+    # and to changes of the control flags, which drop the values held
+    pubsub.subscribe(**{flags.CHANNEL: userdata['flags']})
 
     print("redis pubsub started")
 
-    # create loop which blocks and listens to redis.
-    # Every two seconds, send scope position of packed structure: timestamp, alt, az
+    # create loop which blocks and listens to redis, handlers are called as messages arrive.
+    # Each time round, at least every second, send any batch of positions which is due, and
+    # every minute, set the inbound queue counts and depths into redis
 
-    count = 0
+    stats_time = time.monotonic() + 60
 
     while True:
-        # loop to get redis pubsub messages
-        message = pubsub.get_message()
+        message = pubsub.get_message(timeout=1.0)
         # uncomment for diagnostics
         #if message:
         #    print(message)
-        time.sleep(0.1)
-        count += 1
-        if count > 20:
-            # 2 seconds have passed
-            count = 0
-            telescope_topic = userdata['from_topic'] + '/Telescope/position'
-            telescope_position = rconn.get('telescope_position')
-            if telescope_position:
-                print(telescope_topic)
-                mqtt_client.publish(topic=telescope_topic, payload=telescope_position)
+        position_batcher.flush_due()
+        if time.monotonic() > stats_time:
+            stats_time += 60
+            rconn.hset('rempi01_mqtt_inbound', mapping=userdata['inbound'].stats())
+            userdata['inbound'].reset_stats()
 
 
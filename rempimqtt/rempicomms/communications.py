@@ -8,15 +8,17 @@
 #
 #############################################################################
 
+import json, time
+
 from struct import pack, unpack
 
 
 def action(client, userdata, message):
     """called to initiate a control action by publishing to
        a redis topic control01, control02 etc.,"""
-    # check if control via the main web server is enabled
+    # check if control via the main web server is enabled, the flag is held by userdata['flags']
     rconn = userdata['rconn']
-    web_control = rconn.get('rempi01_web_control')
+    web_control = userdata['flags'].get('rempi01_web_control')
     if web_control == b'DISABLED':
         return
 
@@ -46,7 +48,7 @@ def action(client, userdata, message):
 def telescope_goto(client, userdata, message):
     """Called to accept From_WebServer/Telescope/goto topic and publish payload to redis"""
     rconn = userdata['rconn']
-    web_control = rconn.get('rempi01_web_control')
+    web_control = userdata['flags'].get('rempi01_web_control')
     if web_control == b'DISABLED':
         return
     rconn.publish('goto', message.payload)
@@ -55,43 +57,88 @@ def telescope_goto(client, userdata, message):
 def telescope_track(client, userdata, message):
     """Called to accept From_ServerEngine/Telescope/track topic and set payload in redis"""
     rconn = userdata['rconn']
-    web_control = rconn.get('rempi01_web_control')
+    web_control = userdata['flags'].get('rempi01_web_control')
     if web_control == b'DISABLED':
         return
-    rconn.set('rempi01_track', message.payload)
-    # the track data is set (not published) as the rempicontrol service does not have to act
-    # on this immediately, it can read the tracking data as it wants it
+    # the track data is set, and a message published on the track channel, on which the
+    # rempicontrol service takes the data from the key. As the key holds only the latest
+    # data, if the service is busy it simply takes the latest when it gets to it
+    pipe = rconn.pipeline(transaction=True)
+    pipe.set('rempi01_track', message.payload)
+    pipe.publish('track', 'NEW')
+    pipe.execute()
 
 def telescope_altaz(client, userdata, message):
     """Called to accept From_WebServer/Telescope/altaz topic and publish payload to redis"""
     rconn = userdata['rconn']
-    web_control = rconn.get('rempi01_web_control')
+    web_control = userdata['flags'].get('rempi01_web_control')
     if web_control == b'DISABLED':
         return
     rconn.publish('altaz', message.payload)
 
 
+def _led_value(value):
+    "The led status published, from the redis value of rempi01_led"
+    if value == b"ON":
+        return 'ON'
+    return 'OFF'
+
+
+def _temperature_value(value):
+    "The temperature published, from the redis value of rempi01_temperature"
+    if value is None:
+        return "0.0"
+    return value.decode("utf-8")
+
+
+def _door_value(value):
+    "The door status published, from the redis value of rempi01_door_status"
+    if value is None:
+        return "UNKNOWN"
+    return value.decode("utf-8")
+
+
+# The status items, each a tuple of the name in the status document, the redis key, the
+# legacy topic, after the from_topic, on which the item is also published, and the function
+# giving the published value from the redis value. Further sensors are added here.
+
+STATUS_ITEMS = ( ('led', 'rempi01_led', '/Outputs/led', _led_value),
+                 ('temperature', 'rempi01_temperature', '/Inputs/temperature', _temperature_value),
+                 ('door', 'rempi01_door_status', '/Inputs/door', _door_value) )
+
+# The status document is published on topic from_topic + '/Status' as compact JSON, an object of
+# "v", the STATUS_VERSION, "t", the unix timestamp of the snapshot, and the value of each status
+# item by name, for example
+#   {"v":1,"t":1600000000.123,"led":"OFF","temperature":"21.5","door":"CLOSED"}
+# A version change indicates a change to the meaning of existing members, new items are
+# simply added.
+
+STATUS_VERSION = 1
+
+
+def status_snapshot(rconn):
+    "Returns a dictionary of the status document, reading all status items from redis in one MGET"
+    values = rconn.mget([key for name, key, topic, value in STATUS_ITEMS])
+    snapshot = {'v':STATUS_VERSION, 't':round(time.time(), 3)}
+    for (name, key, topic, value), redis_value in zip(STATUS_ITEMS, values):
+        snapshot[name] = value(redis_value)
+    return snapshot
+
+
 def led_status(client, userdata):
     "Get the led status from redis and publish it via MQTT"
     rconn = userdata['rconn']
     # get led status from redis
-    led_status = rconn.get('rempi01_led')
+    led_status = _led_value(rconn.get('rempi01_led'))
     topic = userdata['from_topic'] + '/Outputs/led'
-    if led_status == b"ON":
-        client.publish(topic=topic, payload='ON')
-    else:
-        client.publish(topic=topic, payload='OFF')
+    client.publish(topic=topic, payload=led_status)
 
 
 def temperature_status(client, userdata):
     "Get the temperature from redis and publish it via MQTT"
     rconn = userdata['rconn']
     # get temperature from redis
-    temperature = rconn.get('rempi01_temperature')
-    if temperature is None:
-        temperature = "0.0"
-    else:
-        temperature = temperature.decode("utf-8")
+    temperature = _temperature_value(rconn.get('rempi01_temperature'))
     topic = userdata['from_topic'] + '/Inputs/temperature'
     client.publish(topic=topic, payload=temperature)
 
@@ -100,19 +147,15 @@ def door_status(client, userdata):
     "Get the door from redis and publish it via MQTT"
     rconn = userdata['rconn']
     # get door status from redis
-    status = rconn.get('rempi01_door_status')
-    if status is None:
-        status = "UNKNOWN"
-    else:
-        status = status.decode("utf-8")
+    status = _door_value(rconn.get('rempi01_door_status'))
     topic = userdata['from_topic'] + '/Inputs/door'
     client.publish(topic=topic, payload=status)
 
 
 def status_request(client, userdata):
-    "a full status request of all values"
-    led_status(client, userdata)
-    temperature_status(client, userdata)
-    door_status(client, userdata)
-
-
+    """a full status request of all values, read in one round trip, published as the status
+       document, and on the legacy topic of each item"""
+    snapshot = status_snapshot(userdata['rconn'])
+    client.publish(topic=userdata['from_topic'] + '/Status', payload=json.dumps(snapshot, separators=(',', ':')))
+    for name, key, topic, value in STATUS_ITEMS:
+        client.publish(topic=userdata['from_topic'] + topic, payload=snapshot[name])
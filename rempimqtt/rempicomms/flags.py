@@ -0,0 +1,77 @@
+############################################################################
+#
+# flags.py - this module defines FlagCache
+#
+# a read-through cache of redis control flags, such as rempi01_web_control,
+# checked by the handler of every received command
+#
+#############################################################################
+
+import time, threading
+
+
+# Rather than a redis GET for each command received, a flag is read once and held. Whatever
+# changes a flag publishes the name of its key on the CHANNEL, and the FlagCache, subscribed
+# to that channel in the pimqtt pubsub loop, drops the held value, so the next get reads it
+# again. So a change takes effect as soon as the message is received. In case a message is
+# missed, as when redis reconnects, a held value is read again after MAX_AGE seconds.
+
+# To change a flag, in a single transaction:
+#   pipe = rconn.pipeline()
+#   pipe.set('rempi01_web_control', 'DISABLED')
+#   pipe.publish(flags.CHANNEL, 'rempi01_web_control')
+#   pipe.execute()
+
+CHANNEL = 'flags'
+
+
+class FlagCache(object):
+
+    MAX_AGE = 60.0 # seconds a value is held without an invalidation
+
+    def __init__(self, rconn, monotonic=time.monotonic):
+        self.rconn = rconn
+        self.monotonic = monotonic
+        # key:(value, monotonic time read)
+        self._values = {}
+        # incremented by each invalidation, so a value read from redis as an invalidation
+        # arrives is not then held
+        self._generation = 0
+        self._lock = threading.Lock()
+        # counts of gets answered from the cache, and of those read from redis
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        "Returns the value of key, as bytes, or None if the key is not set"
+        held = self._values.get(key)
+        now = self.monotonic()
+        if held is not None and now - held[1] < self.MAX_AGE:
+            self.hits += 1
+            return held[0]
+        self.misses += 1
+        generation = self._generation
+        value = self.rconn.get(key)
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = (value, now)
+        return value
+
+
+    def invalidate(self, key=None):
+        "Drops the held value of key, or of all keys if key is None"
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+
+    def __call__(self, msg):
+        "Handles the redis pubsub message on CHANNEL, holding the key changed, or empty for all keys"
+        key = msg['data']
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        self.invalidate(key or None)
@@ -0,0 +1,135 @@
+############################################################################
+#
+# frames.py - this module encodes and decodes batched position frames
+#
+# which send every position notified by rempicontrol to the server as
+# one MQTT message per batch, rather than one message per position
+#
+#############################################################################
+
+import time
+
+from struct import Struct, unpack
+
+import numpy as np
+
+
+# Frame format, version 1, all values little endian:
+#
+#   header   4 bytes   b'RPOS'
+#            1 byte    format version, 1
+#            1 byte    flags, bit 0 set if the offsets are float32, clear if float64
+#            2 bytes   unsigned count of samples, at least 1
+#   base    24 bytes   the first sample, timestamp, alt, az as float64
+#   offsets            for each further sample, its timestamp, alt, az less those of the
+#                      base sample, as float32 or float64, the az offset in the range -180 to 180
+#
+# Offsets are taken from the base sample rather than the previous one, so rounding of float32
+# offsets does not accumulate along the frame. Over a batch of ten seconds the float32 timestamp
+# offsets hold microseconds, and the angle offsets, which can be tens of degrees while slewing,
+# hold a few millionths of a degree.
+#
+# A frame of n samples is 32 + 12*(n-1) bytes with float32 offsets, against 24*n bytes for the
+# same samples sent as single positions, which also each carry the MQTT topic and header.
+
+MAGIC = b'RPOS'
+
+VERSION = 1
+
+FLOAT32 = 1  # flag bit
+
+HEADER = Struct("<4sBBHddd")
+
+
+def encode(samples, float32=True):
+    "Returns a frame of samples, a sequence of (timestamp, alt, az) with at least one sample"
+    samples = np.asarray(samples, dtype=float).reshape(-1, 3)
+    count = len(samples)
+    if not count or count > 0xFFFF:
+        raise ValueError("A frame holds from 1 to 65535 samples")
+    base = samples[0]
+    offsets = samples[1:] - base
+    offsets[:,2] = (offsets[:,2] + 180.0) % 360.0 - 180.0
+    flags = FLOAT32 if float32 else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, count, base[0], base[1], base[2])
+    return header + offsets.astype("<f4" if float32 else "<f8").tobytes()
+
+
+def decode(frame):
+    "Returns numpy arrays timestamps, alts, azs of the samples in a frame, raises ValueError if it is not a valid frame"
+    if len(frame) < HEADER.size:
+        raise ValueError("Frame too short")
+    magic, version, flags, count, timestamp, alt, az = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError("Not a position frame")
+    if version != VERSION:
+        raise ValueError("Unsupported frame version %s" % (version,))
+    dtype = np.dtype("<f4" if flags & FLOAT32 else "<f8")
+    if len(frame) != HEADER.size + (count - 1)*3*dtype.itemsize:
+        raise ValueError("Frame length does not match its count")
+    samples = np.empty((count, 3))
+    samples[0] = timestamp, alt, az
+    samples[1:] = np.frombuffer(frame, dtype=dtype, offset=HEADER.size).reshape(-1, 3)
+    samples[1:] += samples[0]
+    samples[:,2] %= 360.0
+    return samples[:,0], samples[:,1], samples[:,2]
+
+
+class PositionBatcher(object):
+    """Collects each position notified by rempicontrol, and sends them as a frame every INTERVAL
+       seconds, or when MAX_SAMPLES are held"""
+
+    INTERVAL = 10.0 # seconds between frames
+
+    MAX_SAMPLES = 200 # samples in a frame, sent early if reached
+
+    FLOAT32 = True # encode offsets as float32
+
+    def __init__(self, send, monotonic=time.monotonic):
+        "send is called with each frame"
+        self.send = send
+        self.monotonic = monotonic
+        self.samples = []
+        self.started = None
+        # counts of frames sent, and of the samples and bytes in them
+        self.frames = 0
+        self.sent_samples = 0
+        self.sent_bytes = 0
+
+
+    def __call__(self, msg):
+        "Handles the redis pubsub position notification"
+        self.add(msg['data'])
+
+
+    def add(self, data):
+        "Adds the packed position at the start of a notification, sending a frame if one is due"
+        try:
+            sample = unpack("ddd", data[:24])
+        except Exception:
+            return
+        now = self.monotonic()
+        if not self.samples:
+            self.started = now
+        self.samples.append(sample)
+        if len(self.samples) >= self.MAX_SAMPLES or now - self.started >= self.INTERVAL:
+            self.flush()
+
+
+    def flush_due(self):
+        """Sends the samples held if the first was added INTERVAL seconds ago, called periodically so the
+           last samples are sent when notifications stop, as when the mount stops"""
+        if self.samples and self.monotonic() - self.started >= self.INTERVAL:
+            self.flush()
+
+
+    def flush(self):
+        "Sends any samples held as a frame"
+        if not self.samples:
+            return
+        frame = encode(self.samples, self.FLOAT32)
+        self.frames += 1
+        self.sent_samples += len(self.samples)
+        self.sent_bytes += len(frame)
+        self.samples = []
+        self.send(frame)
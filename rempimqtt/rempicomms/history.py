@@ -0,0 +1,57 @@
+############################################################################
+#
+# history.py - this module reads the history of telescope positions
+#
+# which the rempicontrol service appends every control tick to the redis
+# stream rempi01_position_history
+#
+#############################################################################
+
+import time
+
+import numpy as np
+
+
+# Each stream entry has a single field p, the position packed as "ddd", timestamp, alt, az,
+# the same as the telescope_position key. The stream is capped by rempicontrol to
+# approximately an hour of ticks.
+
+STREAM = 'rempi01_position_history'
+
+FIELD = b'p'
+
+# Entry ids are given by redis as the time in milliseconds the entry was added, which is
+# just after the tick of its position, as the entries are written once each tick is done.
+# So entries are searched by id up to this many seconds after the end of the time
+# window, and then selected by their own timestamps.
+LATENCY = 10.0
+
+
+def positions(rconn, start=None, end=None, step=None):
+    """Returns numpy arrays timestamps, alts, azs of the positions from timestamp start to end,
+       start defaults to the oldest held, end to now. If step is given, in seconds, the positions
+       are downsampled to the first in each step from start"""
+    if end is None:
+        end = time.time()
+    low = '-' if start is None else int(start*1000)
+    high = int((end + LATENCY)*1000)
+    entries = rconn.xrange(STREAM, min=low, max=high)
+    data = b''.join(fields[FIELD] for entryid, fields in entries if FIELD in fields)
+    records = np.frombuffer(data, dtype=float).reshape(-1, 3)
+    selected = records[:,0] <= end
+    if start is not None:
+        selected &= records[:,0] >= start
+    records = records[selected]
+    if step and len(records):
+        # the index of the first record in each step
+        origin = records[0,0] if start is None else start
+        steps = np.floor((records[:,0] - origin)/step)
+        first = np.flatnonzero(np.diff(steps, prepend=-1.0))
+        records = records[first]
+    return records[:,0], records[:,1], records[:,2]
+
+
+def latest(rconn, seconds, step=None):
+    "Returns numpy arrays timestamps, alts, azs of the positions over the last seconds, downsampled as positions"
+    end = time.time()
+    return positions(rconn, end - seconds, end, step)
@@ -0,0 +1,111 @@
+############################################################################
+#
+# inbound.py - this module defines InboundQueue
+#
+# which takes the handling of received MQTT messages off the paho
+# network thread, onto a worker thread
+#
+#############################################################################
+
+import threading, heapq, itertools, logging
+
+
+# The handlers of received messages make blocking redis calls, run on the paho network
+# thread a slow redis would hold up MQTT keepalives and the receipt of further messages.
+# Instead _on_message submits each handler to the InboundQueue, which is bounded, and is
+# taken in priority order, and in order of submission within a priority, by the worker.
+
+# There is a single worker, so messages of a priority are applied in the order received, such
+# as door OPEN and HALT, or successive gotos. goto, altaz and track share the highest priority,
+# so no earlier track payload, for a previous target, can be applied after a goto.
+
+# If the queue is full, the lowest priority job, the most recent of those, is dropped to
+# make room, or the new job itself if it is of no higher priority. Dropped jobs are counted
+# by priority.
+
+# priorities, lower values are handled first
+TELESCOPE = 0   # goto, altaz and track
+CONTROL = 1     # led and door outputs
+STATUS = 2      # status requests
+
+NAMES = {TELESCOPE:'telescope', CONTROL:'control', STATUS:'status'}
+
+
+class InboundQueue(object):
+
+    MAXSIZE = 50 # jobs held waiting for a worker
+
+    def __init__(self, maxsize=None):
+        self.maxsize = self.MAXSIZE if maxsize is None else maxsize
+        # the heap of jobs, each (priority, sequence, function, args), sequence keeps the order within a priority
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._ready = threading.Condition()
+        self.reset_stats()
+        self._worker = threading.Thread(target=self._run, name='inbound', daemon=True)
+        self._worker.start()
+
+
+    def reset_stats(self):
+        "Resets the counts of jobs, and the maximum depth"
+        self.submitted = 0
+        self.handled = 0
+        self.errors = 0
+        self.overflows = {priority:0 for priority in NAMES}
+        self.max_depth = 0
+
+
+    @property
+    def depth(self):
+        "The number of jobs waiting"
+        return len(self._jobs)
+
+
+    def submit(self, priority, function, *args):
+        "Submits function(*args) to be called by a worker, returns False if it was dropped as the queue is full"
+        with self._ready:
+            self.submitted += 1
+            if len(self._jobs) >= self.maxsize:
+                # drop the lowest priority job, if lower than this one
+                lowest = max(self._jobs)
+                if lowest[0] <= priority:
+                    self.overflows[priority] += 1
+                    return False
+                self._jobs.remove(lowest)
+                heapq.heapify(self._jobs)
+                self.overflows[lowest[0]] += 1
+            heapq.heappush(self._jobs, (priority, next(self._sequence), function, args))
+            if len(self._jobs) > self.max_depth:
+                self.max_depth = len(self._jobs)
+            self._ready.notify()
+        return True
+
+
+    def stats(self):
+        "Returns a dictionary of the counts of jobs, the current and maximum depth, and overflows by priority"
+        stats = { 'inbound_submitted': self.submitted,
+                  'inbound_handled': self.handled,
+                  'inbound_errors': self.errors,
+                  'inbound_depth': self.depth,
+                  'inbound_max_depth': self.max_depth }
+        for priority, name in NAMES.items():
+            stats['inbound_overflow_'+name] = self.overflows[priority]
+        return stats
+
+
+    def _run(self):
+        "The worker thread, calls each job as it is taken from the queue"
+        while True:
+            with self._ready:
+                while not self._jobs:
+                    self._ready.wait()
+                priority, sequence, function, args = heapq.heappop(self._jobs)
+            try:
+                function(*args)
+                error = 0
+            except Exception:
+                error = 1
+                logging.exception('Failed to handle inbound message')
+            with self._ready:
+                self.handled += 1
+                self.errors += error
@@ -0,0 +1,93 @@
+############################################################################
+#
+# positions.py - this module decides when to send the telescope position
+#
+# rempicontrol publishes each position, with the motion state of the
+# telescope, on the redis channel 'position', and a PositionPolicy
+# given each of these chooses which to send via MQTT
+#
+#############################################################################
+
+import time
+
+from struct import unpack
+
+
+# The notification is the position packed as "ddd", timestamp, alt, az, the same as the
+# telescope_position key and the MQTT payload, followed by the motion state as text
+
+CHANNEL = 'position'
+
+SLEWING = 'slewing'
+TRACKING = 'tracking'
+STOPPED = 'stopped'
+
+
+def decode(data):
+    "Returns timestamp, alt, az, state from a position notification"
+    timestamp, alt, az = unpack("ddd", data[:24])
+    return timestamp, alt, az, data[24:].decode("utf-8")
+
+
+# A position is sent if the motion state has changed, or if the scope has moved more than the
+# deadband of its state on either axis since the last position sent, and at least the minimum
+# interval of its state has passed. Otherwise a position is still sent every KEEPALIVE seconds,
+# so the server knows the link and the scope are alive. So a parked scope sends rarely, and a
+# slewing one sends each notification.
+
+
+class PositionPolicy(object):
+
+    # motion state : (deadband in degrees, minimum seconds between positions)
+    RATES = { SLEWING: (0.01, 0.5),
+              TRACKING: (0.005, 5.0),
+              STOPPED: (0.001, 30.0) }
+
+    KEEPALIVE = 60.0 # seconds, the longest time between positions sent
+
+    def __init__(self, send, monotonic=time.monotonic):
+        "send is called with the packed position, timestamp, alt, az, when it is to be sent"
+        self.send = send
+        self.monotonic = monotonic
+        # the state and position last sent, and the monotonic time it was sent
+        self.state = None
+        self.alt = None
+        self.az = None
+        self.sent_at = None
+        # counts of notifications, and of positions sent
+        self.notifications = 0
+        self.sent = 0
+
+
+    def __call__(self, msg):
+        "Handles the redis pubsub position notification"
+        self.update(msg['data'])
+
+
+    def update(self, data):
+        "Given a position notification, sends the position if the policy requires, returns True if sent"
+        self.notifications += 1
+        try:
+            timestamp, alt, az, state = decode(data)
+        except Exception:
+            return False
+        now = self.monotonic()
+        if state != self.state or self.sent_at is None or now - self.sent_at >= self.KEEPALIVE:
+            return self._send(data, now, alt, az, state)
+        deadband, interval = self.RATES.get(state, self.RATES[SLEWING])
+        if now - self.sent_at < interval:
+            return False
+        if abs(alt - self.alt) > deadband or abs((az - self.az + 180.0) % 360.0 - 180.0) > deadband:
+            return self._send(data, now, alt, az, state)
+        return False
+
+
+    def _send(self, data, now, alt, az, state):
+        "Sends the position, and records it as the last sent"
+        self.send(data[:24])
+        self.state = state
+        self.alt = alt
+        self.az = az
+        self.sent_at = now
+        self.sent += 1
+        return True